@@ -0,0 +1,34 @@
+'''
+Measures the CPU cost and the size reduction of every available request compression
+codec on INSERT bodies in the TabSeparated and RowBinary formats.
+
+    python -m benchmarks.compression [rows]
+'''
+import sys
+import timeit
+
+from clickhouse.compression import available_codecs, compress
+from clickhouse.database import Database
+
+from .insert_formats import make_instances
+
+
+def main(rows=100000, repeat=3):
+    instances = make_instances(rows)
+    for insert_format in ('TabSeparated', 'RowBinary'):
+        body = Database._encode_instances(instances, insert_format)
+        print('%s: %d bytes' % (insert_format, len(body)))
+        for codec in available_codecs():
+            for level in (None, 1):
+                compressed = compress(body, codec, level)
+                best = min(timeit.repeat(lambda: compress(body, codec, level), number=1, repeat=repeat))
+                print('  %-5s level %-7s %6.1f%% of original  %8.1f MB/s' % (
+                    codec,
+                    'default' if level is None else level,
+                    100.0 * len(compressed) / len(body),
+                    len(body) / best / 2**20,
+                ))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,58 @@
+'''
+Compares the CPU cost of building INSERT bodies in the TabSeparated and RowBinary formats.
+No ClickHouse server is needed, only the serialization is measured.
+
+    python -m benchmarks.insert_formats [rows]
+'''
+import datetime
+import sys
+import timeit
+
+from clickhouse.database import Database
+from clickhouse.engines import MergeTree
+from clickhouse.fields import (ArrayField, DateField, DateTimeField, Float32Field,
+                               Int32Field, StringField, UInt64Field)
+from clickhouse.models import Model
+
+
+class Event(Model):
+
+    date = DateField()
+    timestamp = DateTimeField()
+    user_id = UInt64Field()
+    name = StringField()
+    duration = Float32Field()
+    tags = ArrayField(Int32Field())
+
+    engine = MergeTree('date', ('date', 'user_id'))
+
+
+def make_instances(rows):
+    now = datetime.datetime(2017, 6, 1, 12, 30)
+    return [
+        Event(
+            date=now.date(),
+            timestamp=now,
+            user_id=i,
+            name=u'event\t%d' % i,
+            duration=i / 3.0,
+            tags=[i % 7, i % 11],
+        )
+        for i in range(rows)
+    ]
+
+
+def main(rows=100000, repeat=5):
+    instances = make_instances(rows)
+    for insert_format in ('TabSeparated', 'RowBinary'):
+        body = Database._encode_instances(instances, insert_format)
+        best = min(timeit.repeat(
+            lambda: Database._encode_instances(instances, insert_format),
+            number=1,
+            repeat=repeat,
+        ))
+        print('%-14s %8.3f s  %10.0f rows/s  %10d bytes' % (insert_format, best, rows / best, len(body)))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
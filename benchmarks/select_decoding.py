@@ -0,0 +1,87 @@
+'''
+Measures the throughput of decoding a TabSeparatedWithNamesAndTypes SELECT response into
+model instances: through the model constructor as before, with the generated decoder
+with and without validation, and as lightweight rows. No ClickHouse server is needed,
+the response is rendered in memory.
+
+    python -m benchmarks.select_decoding [rows]
+'''
+import io
+import sys
+import timeit
+from enum import Enum
+
+from clickhouse.database import Database
+from clickhouse.engines import MergeTree
+from clickhouse.fields import (DateField, Enum8Field, Float32Field, Int16Field, StringField,
+                               UInt64Field)
+from clickhouse.models import Model
+from clickhouse.utils import read_tsv_rows
+
+
+class Status(Enum):
+
+    ok = 1
+    failed = 2
+
+
+class Visit(Model):
+
+    date = DateField()
+    user_id = UInt64Field()
+    url = StringField()
+    duration = Float32Field()
+    code = Int16Field()
+    status = Enum8Field(Status)
+
+    engine = MergeTree('date', ('date', 'user_id'))
+
+
+class Response(object):
+    '''
+    Stands in for a streamed requests response.
+    '''
+
+    def __init__(self, data):
+        self.raw = io.BytesIO(data)
+
+
+def make_response(rows):
+    lines = [
+        'date\tuser_id\turl\tduration\tcode\tstatus',
+        "Date\tUInt64\tString\tFloat32\tInt16\tEnum8('ok' = 1, 'failed' = 2)",
+    ]
+    for i in range(rows):
+        lines.append('2017-06-%02d\t%d\thttps://example.com/page/%d\t%s\t%d\t%s' % (
+            i % 30 + 1, i, i % 1000, i / 7.0, 200 + i % 300, 'ok' if i % 5 else 'failed',
+        ))
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def select_with_constructor(data):
+    # The decoding done by select before the generated decoders
+    rows = read_tsv_rows(io.BytesIO(data))
+    field_names = next(rows)
+    next(rows)
+    return [Visit(**dict(zip(field_names, values))) for values in rows]
+
+
+def select(data, lightweight=False, validate=False):
+    return list(Database._iter_tsv(Response(data), Visit, lightweight, validate))
+
+
+def main(rows=100000, repeat=3):
+    data = make_response(rows)
+    print('%d rows, %d bytes' % (rows, len(data)))
+    for name, decode in (
+            ('constructor', lambda: select_with_constructor(data)),
+            ('validated', lambda: select(data, validate=True)),
+            ('trusted', lambda: select(data)),
+            ('lightweight', lambda: select(data, lightweight=True)),
+    ):
+        best = min(timeit.repeat(decode, number=1, repeat=repeat))
+        print('  %-12s %8.3f s  %10.0f rows/s' % (name, best, rows / best))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
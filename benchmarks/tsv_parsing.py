@@ -0,0 +1,85 @@
+'''
+Compares parsing tab-separated SELECT responses line by line with the former per-value
+escape_decode parser, line by line with parse_tsv, chunk by chunk with parse_tsv_rows,
+and from a stream read into a reusable buffer with read_tsv_rows.
+
+    python -m benchmarks.tsv_parsing [rows]
+'''
+import codecs
+import io
+import sys
+import timeit
+
+from clickhouse.utils import parse_tsv, parse_tsv_rows, read_tsv_rows
+
+from .insert_formats import make_instances
+
+CHUNK_SIZE = 64 * 1024
+
+
+def legacy_parse_tsv(line):
+    line = line.decode()
+    if line[-1] == '\n':
+        line = line[:-1]
+    return [codecs.escape_decode(value)[0].decode('utf-8') for value in line.split('\t')]
+
+
+def numeric_rows(rows):
+    return [u'%d\t%d\t%f\t%d' % (i, i * 7, i / 3.0, i % 2) for i in range(rows)]
+
+
+def event_rows(rows):
+    # Strings with tabs, so that every row has a value to unescape
+    return [instance.to_tsv() for instance in make_instances(rows)]
+
+
+def wide_text_rows(rows):
+    return [u'\t'.join([u'value %d of row %d' % (j, i) for j in range(20)]) for i in range(rows)]
+
+
+def unicode_rows(rows):
+    return [u'%d\tпривет %d\t你好' % (i, i) for i in range(rows)]
+
+
+SHAPES = (
+    ('numeric', numeric_rows),
+    ('event (escaped)', event_rows),
+    ('wide text', wide_text_rows),
+    ('unicode', unicode_rows),
+)
+
+
+def split_chunks(data):
+    # Cut at complete lines, as TSVReader does with the chunks of a response
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = data.rfind(b'\n', start, start + CHUNK_SIZE) + 1
+        if end <= start:
+            end = data.index(b'\n', start) + 1
+        chunks.append(data[start:end])
+        start = end
+    return chunks
+
+
+def main(rows=100000, repeat=3):
+    for title, make_rows in SHAPES:
+        lines = [(line + u'\n').encode('utf-8') for line in make_rows(rows)]
+        data = b''.join(lines)
+        chunks = split_chunks(data)
+        assert [legacy_parse_tsv(line) for line in lines] == [
+            row for chunk in chunks for row in parse_tsv_rows(chunk)
+        ]
+        print('%s: %d bytes' % (title, sum(len(line) for line in lines)))
+        for name, parse in (
+                ('escape_decode', lambda: [legacy_parse_tsv(line) for line in lines]),
+                ('parse_tsv', lambda: [parse_tsv(line) for line in lines]),
+                ('parse_tsv_rows', lambda: [parse_tsv_rows(chunk) for chunk in chunks]),
+                ('read_tsv_rows', lambda: list(read_tsv_rows(io.BytesIO(data)))),
+        ):
+            best = min(timeit.repeat(parse, number=1, repeat=repeat))
+            print('  %-15s %8.3f s  %10.0f rows/s' % (name, best, rows / best))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,316 @@
+'''
+asyncio client for ClickHouse built on aiohttp. Requires Python 3.6+ and aiohttp.
+'''
+import asyncio
+
+import aiohttp
+
+from .database import (BINARY_CHUNK_SIZE, INSERT_FORMATS, SELECT_FORMATS, BaseDatabase,
+                       DatabaseException, InsertBuffer, error_log)
+from .models import ModelBase
+from .utils import BinaryFeedReader, TSVReader
+
+
+class AsyncDatabase(BaseDatabase):
+    '''
+    A non-blocking counterpart of Database with the same topology, retry and cooldown
+    behaviour. Every call is a coroutine, so a single event loop can keep many queries
+    in flight (up to connections_limit at once).
+
+    The database is not created in the constructor, use AsyncDatabase.connect or
+    await create_database() before the first query.
+    '''
+
+    def __init__(
+            self,
+            topology,
+            database_name,
+            username=None,
+            password=None,
+            backoff=None,
+            buffer_size=0,
+            timeout=None,
+            insert_format='TabSeparated',
+            select_format='TabSeparatedWithNamesAndTypes',
+            validate_selects=False,
+            host_selection='random',
+            connections_limit=100,
+    ):
+        super(AsyncDatabase, self).__init__(
+            topology,
+            database_name,
+            username=username,
+            password=password,
+            backoff=backoff,
+            buffer_size=buffer_size,
+            timeout=timeout,
+            threaded=False,
+            insert_format=insert_format,
+            select_format=select_format,
+            validate_selects=validate_selects,
+            host_selection=host_selection,
+        )
+        self._connections_limit = connections_limit
+        self._session = None
+        # aiohttp does not accept None in query parameters
+        self._params = {}
+        if username is not None:
+            self._params['user'] = username
+        if password is not None:
+            self._params['password'] = password
+
+    @classmethod
+    async def connect(cls, *args, wait_for_databases_init_time=300, **kwargs):
+        '''
+        Creates a client and makes sure the database exists on every host.
+        '''
+        database = cls(*args, **kwargs)
+        await database.create_database(timeout=wait_for_databases_init_time)
+        return database
+
+    def _get_session(self):
+        # The session must be created inside the running event loop
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self._connections_limit),
+            )
+        return self._session
+
+    @staticmethod
+    def _client_timeout(timeout):
+        return aiohttp.ClientTimeout(total=timeout)
+
+    async def query(self, query, timeout=None, data=None):
+        '''
+        Sends the query to one of the available hosts, moving on to other hosts on failure.
+        When data is passed, the query goes to the URL and data is sent as the request body.
+        Returns the aiohttp response, which must be released by the caller.
+        '''
+        timeout = timeout or self._timeout
+        params = self._params
+        if data is None:
+            data = query
+        else:
+            params = dict(params, query=query)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        session = self._get_session()
+        while True:
+            target_host = self._host_selector.select()
+            started = self._host_selector.start(target_host)
+            failed = True
+            try:
+                r = await session.post(
+                    target_host,
+                    params=params,
+                    data=data,
+                    timeout=self._client_timeout(timeout),
+                )
+                if r.status == 200:
+                    failed = False
+                    self._backoff.reset(target_host)
+                    return r
+                text = await r.text()
+                r.release()
+                raise DatabaseException(text)
+            except (aiohttp.ClientError, asyncio.TimeoutError, DatabaseException) as ex:
+                error_log.error(
+                    'Error while requesting to %s: %s',
+                    target_host,
+                    ex,
+                )
+                bo = self._backoff(target_host)
+                self._cool_down_host(target_host, bo)
+                error_log.error(
+                    'Host %s is cooling down for %d seconds',
+                    target_host,
+                    bo,
+                )
+            finally:
+                self._host_selector.finish(target_host, started, failed)
+
+    async def _post(self, target_host, query, timeout):
+        async with self._get_session().post(
+                target_host,
+                params=self._params,
+                data=query.encode('utf-8'),
+                timeout=self._client_timeout(timeout),
+        ) as r:
+            text = await r.text()
+            if r.status != 200:
+                raise DatabaseException(text)
+            self._note_server_timezone(r.headers)
+
+    async def broadcast_query(self, query, ensure=True, timeout=None):
+        '''
+        Sends the query to all hosts concurrently. Returns a BroadcastResult;
+        with ensure, the first error is raised instead.
+        '''
+        timeout = timeout or self._timeout
+        hosts = sorted(self._host_manager.hosts_set())
+        results = await asyncio.gather(
+            *[self._post(target_host, query, timeout) for target_host in hosts],
+            return_exceptions=True
+        )
+        return self._collect_broadcast(zip(hosts, results), ensure)
+
+    async def create_database(self, timeout=None):
+        return await self.broadcast_query(
+            'CREATE DATABASE IF NOT EXISTS `%s`' % self._database_name,
+            ensure=True,
+            timeout=timeout,
+        )
+
+    async def create_table(self, model_class, timeout=None):
+        return await self.broadcast_query(
+            model_class.create_table_sql(self._database_name),
+            ensure=True,
+            timeout=timeout,
+        )
+
+    async def drop_table(self, model_class, timeout=None):
+        return await self.broadcast_query(
+            model_class.drop_table_sql(self._database_name),
+            ensure=True,
+            timeout=timeout,
+        )
+
+    async def drop_database(self, timeout=None):
+        return await self.broadcast_query(
+            'DROP DATABASE `%s`' % self._database_name,
+            ensure=True,
+            timeout=timeout,
+        )
+
+    def _get_buffer(self, model_class, insert_format):
+        # Only the event loop's thread touches the buffers, so no locking is needed
+        key = (model_class, insert_format)
+        if key not in self._buffer:
+            self._buffer[key] = InsertBuffer(model_class, insert_format)
+        return self._buffer[key]
+
+    async def _send_buffer(self, insert_buffer):
+        data = insert_buffer.release()
+        if data is not None:
+            query = self._substitute(
+                'INSERT INTO $table FORMAT %s' % insert_buffer.insert_format,
+                insert_buffer.model_class
+            )
+            r = await self.query(query, data=data.getvalue())
+            r.release()
+
+    async def insert(self, model_instances, insert_format=None):
+        '''
+        Encodes the instances and adds them to the model's buffer, which is sent once it
+        holds more than buffer_size rows, as in Database.insert.
+        '''
+        model_instances = list(model_instances)
+        if len(model_instances) == 0:
+            return
+        model_class = model_instances[0].__class__
+        insert_format = self._check_choice(insert_format or self._insert_format, INSERT_FORMATS)
+        insert_buffer = self._get_buffer(model_class, insert_format)
+        insert_buffer.append(
+            self._encode_instances(model_instances, insert_format),
+            len(model_instances),
+        )
+        if insert_buffer.rows > self._buffer_size:
+            await self._send_buffer(insert_buffer)
+
+    async def insert_columns(self, model_class, columns):
+        '''
+        Inserts rows given as columns, see Database.insert_columns.
+        '''
+        encoded = self._encode_columns(model_class, columns)
+        if encoded is None:
+            return
+        query, body = encoded
+        r = await self.query(self._substitute(query, model_class), data=body)
+        r.release()
+
+    async def flush(self):
+        '''
+        Sends all buffered rows concurrently.
+        '''
+        await asyncio.gather(*[
+            self._send_buffer(insert_buffer) for insert_buffer in list(self._buffer.values())
+        ])
+
+    async def select(self, query, model_class=None, select_format=None, lightweight=False,
+                     validate=None):
+        '''
+        An asynchronous generator of model instances, see Database.select.
+        '''
+        validate = self._validate_selects if validate is None else validate
+        select_format = self._check_choice(select_format or self._select_format, SELECT_FORMATS)
+        query += ' FORMAT ' + select_format
+        query = self._substitute(query, model_class)
+        r = await self.query(query)
+        try:
+            if select_format == 'RowBinaryWithNamesAndTypes':
+                self._note_server_timezone(r.headers)
+                instances = self._iter_rowbinary(r, model_class, lightweight, validate)
+            else:
+                instances = self._iter_tsv(r, model_class, lightweight, validate)
+            async for instance in instances:
+                yield instance
+        finally:
+            r.release()
+
+    @staticmethod
+    async def _iter_tsv_rows(r):
+        reader = TSVReader()
+        async for chunk in r.content.iter_chunked(BINARY_CHUNK_SIZE):
+            for row in reader.feed(chunk):
+                yield row
+        for row in reader.close():
+            yield row
+
+    async def _iter_tsv(self, r, model_class, lightweight, validate):
+        rows = self._iter_tsv_rows(r)
+        field_names = await rows.__anext__()
+        field_types = await rows.__anext__()
+        model_class = model_class or ModelBase.create_ad_hoc_model(zip(field_names, field_types))
+        decode = model_class.row_decoder(field_names, lightweight, validate)
+        async for values in rows:
+            yield decode(values)
+
+    async def _iter_rowbinary(self, r, model_class, lightweight, validate):
+        # Every chunk is fed to a single reader; a row cut by the end of a chunk is
+        # read again from its start once the next chunk arrives
+        reader = BinaryFeedReader()
+        columns = None
+        async for chunk in r.content.iter_chunked(BINARY_CHUNK_SIZE):
+            reader.feed(chunk)
+            try:
+                if columns is None:
+                    model_class, columns = self._read_rowbinary_header(
+                        reader, model_class, self._server_timezone
+                    )
+                    names = [name for name, field in columns]
+                    decode = model_class.row_decoder(names, lightweight, validate)
+                    read_values = [field.read_binary for name, field in columns]
+                    reader.commit()
+                while not reader.at_eof():
+                    values = [read_value(reader) for read_value in read_values]
+                    reader.commit()
+                    yield decode(values)
+            except EOFError:
+                reader.rollback()
+        if not reader.at_eof():
+            raise EOFError('Unexpected end of binary stream')
+
+    async def count(self, model_class, conditions=None):
+        query = 'SELECT count() FROM $table'
+        if conditions:
+            query += ' WHERE ' + conditions
+        query = self._substitute(query, model_class)
+        r = await self.query(query)
+        text = await r.text()
+        r.release()
+        return int(text) if text else 0
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
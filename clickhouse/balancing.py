@@ -0,0 +1,118 @@
+'''
+Host selection policies for queries. Candidates always come from HostManager.get(),
+so priorities and cooldowns are respected; the policies only choose among them.
+'''
+import time
+from collections import deque
+from threading import Lock
+
+
+class HostSelector(object):
+    '''
+    The default policy: the host returned by HostManager.get(), picked randomly among
+    the available hosts of the best priority. Also keeps the per-host metrics used by
+    the other policies: requests, errors, outstanding requests and the exponentially
+    weighted moving average of the time to response headers.
+    '''
+
+    # Weight of the latest request in the latency average
+    alpha = 0.2
+    # Number of recent latencies (of all hosts) kept for latency_percentile
+    window = 1000
+
+    def __init__(self, host_manager, choices=2):
+        self._host_manager = host_manager
+        self._choices = choices
+        self._lock = Lock()
+        self._hosts = {}
+        self._latencies = deque(maxlen=self.window)
+
+    def _get_stats(self, host):
+        stats = self._hosts.get(host)
+        if stats is None:
+            stats = self._hosts[host] = dict(requests=0, errors=0, outstanding=0, latency_ms=None)
+        return stats
+
+    def select(self):
+        return self._host_manager.get()
+
+    def _select_best(self, key):
+        # Power of two choices: the better of a few random candidates
+        candidates = [self._host_manager.get() for _ in range(self._choices)]
+        with self._lock:
+            return min(candidates, key=lambda host: key(self._get_stats(host)))
+
+    def start(self, host):
+        '''
+        Registers a request to the host, returns its start time for finish().
+        '''
+        with self._lock:
+            stats = self._get_stats(host)
+            stats['requests'] += 1
+            stats['outstanding'] += 1
+        return time.time()
+
+    def finish(self, host, started, failed):
+        latency_ms = (time.time() - started) * 1000
+        with self._lock:
+            stats = self._get_stats(host)
+            stats['outstanding'] -= 1
+            if failed:
+                stats['errors'] += 1
+                return
+            self._latencies.append(latency_ms)
+            if stats['latency_ms'] is None:
+                stats['latency_ms'] = latency_ms
+            else:
+                stats['latency_ms'] += self.alpha * (latency_ms - stats['latency_ms'])
+
+    def latency_percentile(self, percentile, min_samples=20):
+        '''
+        Returns the given percentile of the recent latencies in milliseconds,
+        or None while there are fewer than min_samples of them.
+        '''
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if len(latencies) < min_samples:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100.0))]
+
+    def stats(self):
+        '''
+        Returns a copy of the metrics as {host: {metric: value}}.
+        '''
+        with self._lock:
+            return dict((host, dict(stats)) for host, stats in self._hosts.items())
+
+
+class EWMAHostSelector(HostSelector):
+    '''
+    Picks the candidate with the lowest average latency. Hosts without
+    finished requests yet count as the fastest, so that they get measured,
+    and hosts whose requests have all failed count as the slowest.
+    '''
+
+    @staticmethod
+    def _score(stats):
+        if stats['latency_ms'] is not None:
+            return stats['latency_ms']
+        return float('inf') if stats['errors'] else 0
+
+    def select(self):
+        return self._select_best(self._score)
+
+
+class LeastOutstandingHostSelector(HostSelector):
+    '''
+    Picks the candidate with the fewest requests in flight.
+    '''
+
+    def select(self):
+        return self._select_best(lambda stats: stats['outstanding'])
+
+
+HOST_SELECTORS = {
+    'random': HostSelector,
+    'ewma': EWMAHostSelector,
+    'least_outstanding': LeastOutstandingHostSelector,
+}
@@ -0,0 +1,229 @@
+'''
+Client-side cache of raw query responses, see Database(cache_ttl=...), and coalescing
+of identical concurrent queries, see Database(coalesce_reads=True).
+'''
+import io
+import sys
+import time
+from collections import OrderedDict
+from threading import Event, Lock
+
+import six
+
+
+class ResultCache(object):
+    '''
+    A thread-safe cache of response bodies which expire ttl seconds after they were
+    stored. When the bodies take more than max_bytes, the least recently used ones
+    are evicted.
+    '''
+
+    def __init__(self, ttl, max_bytes):
+        self._ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._stats = dict(hits=0, misses=0, evictions=0)
+
+    def get(self, key):
+        '''
+        Returns the cached body, or None if it is missing or expired.
+        '''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.time():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['hits'] += 1
+            # Move the entry to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[1]
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self._ttl, data)
+            self._size += len(data)
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats['evictions'] += 1
+
+    def _remove(self, key):
+        expires, data = self._entries.pop(key)
+        self._size -= len(data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        '''
+        Returns the numbers of hits, misses and evictions, and the current number
+        of entries and their size in bytes.
+        '''
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries), bytes=self._size)
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    '''
+    Runs a function once per key at a time: callers arriving while the call for the
+    same key is in flight wait for it and share its result or exception.
+    '''
+
+    def __init__(self):
+        self._lock = Lock()
+        self._calls = {}
+        self._stats = dict(leaders=0, followers=0)
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._stats['leaders'] += 1
+            else:
+                self._stats['followers'] += 1
+        if not leader:
+            call.done.wait()
+        else:
+            try:
+                call.result = fn()
+            except BaseException:
+                # Also interruptions, so that followers never get a result of None
+                call.exc_info = sys.exc_info()
+            finally:
+                # Later callers start a new call
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+        if call.exc_info is not None:
+            six.reraise(*call.exc_info)
+        return call.result
+
+    def stats(self):
+        '''
+        Returns the numbers of calls made (leaders) and of callers which shared the
+        result of another one (followers).
+        '''
+        with self._lock:
+            return dict(self._stats)
+
+
+class CachedResponse(object):
+    '''
+    Replays a cached body through the parts of the requests response API used by
+    the select and count methods.
+    '''
+
+    status_code = 200
+
+    def __init__(self, content):
+        self.content = content
+        self.raw = io.BytesIO(content)
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=1):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def close(self):
+        pass
+
+
+class _RecordingReader(object):
+    '''
+    Reads the decoded body of a streamed urllib3 response and keeps a copy of it as long
+    as it takes at most max_bytes. Once the body has been read to the end, the copy is
+    passed to on_complete.
+    '''
+
+    def __init__(self, raw, max_bytes, on_complete):
+        self._raw = raw
+        self._max_bytes = max_bytes
+        self._on_complete = on_complete
+        self._chunks = []
+        self._size = 0
+        self._pending = b''
+        # The body is always decoded, callers setting this have no effect
+        self.decode_content = True
+
+    def read(self, amt=None):
+        if self._pending:
+            data, self._pending = self._pending[:amt], self._pending[amt:] if amt else b''
+            return data
+        data = self._raw.read(amt, decode_content=True)
+        if self._chunks is not None:
+            if data:
+                self._size += len(data)
+                if self._size > self._max_bytes:
+                    # Too big to be cached, the rest is only streamed
+                    self._chunks = None
+                else:
+                    self._chunks.append(data)
+            elif amt is None or amt > 0:
+                chunks, self._chunks = self._chunks, None
+                self._on_complete(b''.join(chunks))
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        if len(data) > len(b):
+            # Older urllib3 versions may decode more than asked for, the rest is
+            # kept for the next call
+            data, self._pending = data[:len(b)], data[len(b):]
+        b[:len(data)] = data
+        return len(data)
+
+
+class RecordingResponse(object):
+    '''
+    Streams a response through the parts of the requests response API used by the
+    select and count methods, see _RecordingReader.
+    '''
+
+    status_code = 200
+
+    def __init__(self, response, max_bytes, on_complete, chunk_size=64 * 1024):
+        self._response = response
+        self._chunk_size = chunk_size
+        self.raw = _RecordingReader(response.raw, max_bytes, on_complete)
+
+    @property
+    def content(self):
+        return b''.join(self.iter_content(self._chunk_size))
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+    def iter_content(self, chunk_size=1):
+        while True:
+            chunk = self.raw.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+    def close(self):
+        self._response.close()
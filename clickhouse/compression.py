@@ -0,0 +1,83 @@
+'''
+Compression of HTTP request bodies sent to ClickHouse with a Content-Encoding header.
+gzip is always available, zstd and lz4 need the zstandard and lz4 packages.
+'''
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+
+def _gzip_compressor(level):
+    # wbits=31 produces the gzip container rather than raw zlib
+    return zlib.compressobj(6 if level is None else level, zlib.DEFLATED, 31)
+
+
+def _gzip(data, level):
+    compressor = _gzip_compressor(level)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _zstd_compressor(level):
+    return zstandard.ZstdCompressor(level=3 if level is None else level)
+
+
+def _zstd(data, level):
+    return _zstd_compressor(level).compress(data)
+
+
+def _lz4(data, level):
+    return lz4_frame.compress(data, compression_level=0 if level is None else level)
+
+
+CODECS = {
+    'gzip': _gzip,
+    'zstd': _zstd,
+    'lz4': _lz4,
+}
+
+
+def available_codecs():
+    '''
+    Returns the names of the codecs whose libraries are installed.
+    '''
+    codecs = ['gzip']
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4_frame is not None:
+        codecs.append('lz4')
+    return codecs
+
+
+def compress(data, codec, level=None):
+    '''
+    Compresses bytes (or the contents of a file object) with the given codec.
+    '''
+    if hasattr(data, 'read'):
+        data = data.read()
+    return CODECS[codec](data, level)
+
+
+def compress_stream(chunks, codec, level=None):
+    '''
+    Compresses an iterable of byte chunks with the given codec, yielding compressed chunks.
+    '''
+    if codec == 'lz4':
+        compressor = lz4_frame.LZ4FrameCompressor(compression_level=0 if level is None else level)
+        yield compressor.begin()
+    elif codec == 'zstd':
+        compressor = _zstd_compressor(level).compressobj()
+    else:
+        compressor = _gzip_compressor(level)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,82 @@
+'''
+HTTP connection pooling for Database: a requests adapter whose urllib3 pools count
+how often connections to every host are reused, opened and discarded.
+'''
+from threading import Lock
+
+import requests
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+class ConnectionStats(object):
+    '''
+    Per-host connection counters:
+        hits - requests sent over an idle pooled connection
+        misses - requests that had to connect first
+        opened - connection objects created
+        discarded - connections closed on release because the pool was full
+    '''
+
+    COUNTERS = ('hits', 'misses', 'opened', 'discarded')
+
+    def __init__(self):
+        self._lock = Lock()
+        self._hosts = {}
+
+    def count(self, host, counter):
+        with self._lock:
+            counters = self._hosts.get(host)
+            if counters is None:
+                counters = self._hosts[host] = dict.fromkeys(self.COUNTERS, 0)
+            counters[counter] += 1
+
+    def snapshot(self):
+        '''
+        Returns a copy of the counters as {host: {counter: value}}.
+        '''
+        with self._lock:
+            return dict((host, dict(counters)) for host, counters in self._hosts.items())
+
+
+def _counting_pool_class(pool_class, stats):
+    class CountingConnectionPool(pool_class):
+
+        def _host_url(self):
+            return '%s://%s:%s' % (self.scheme, self.host, self.port)
+
+        def _new_conn(self):
+            stats.count(self._host_url(), 'opened')
+            return super(CountingConnectionPool, self)._new_conn()
+
+        def _get_conn(self, timeout=None):
+            conn = super(CountingConnectionPool, self)._get_conn(timeout)
+            # Dropped connections have been closed and reconnect when used
+            connected = getattr(conn, 'sock', None) is not None
+            stats.count(self._host_url(), 'hits' if connected else 'misses')
+            return conn
+
+        def _put_conn(self, conn):
+            if conn is not None and self.pool is not None and self.pool.full():
+                stats.count(self._host_url(), 'discarded')
+            super(CountingConnectionPool, self)._put_conn(conn)
+
+    return CountingConnectionPool
+
+
+class CountingHTTPAdapter(requests.adapters.HTTPAdapter):
+    '''
+    An HTTPAdapter which keeps pool_connections pools of up to pool_maxsize
+    connections each (one pool per host) and counts their use in stats.
+    '''
+
+    def __init__(self, stats, **kwargs):
+        # init_poolmanager is called by the base constructor
+        self.stats = stats
+        super(CountingHTTPAdapter, self).__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(CountingHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _counting_pool_class(HTTPConnectionPool, self.stats),
+            'https': _counting_pool_class(HTTPSConnectionPool, self.stats),
+        }
@@ -1,20 +1,72 @@
 # flake8: noqa
+import io
+import itertools
 import logging
+import math
+import random
+import shutil
+import time
 import types
-from collections import namedtuple
+import uuid
+from collections import OrderedDict, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from string import Template
-from threading import Lock
+from threading import Event, Lock, Thread
 
+import pytz
 import requests
+import urllib3
 from izihawa_commons.schedule.backoff import ExponentialBackoff
 from izihawa_commons.schedule.host_manager import NoAvailableHostsException
 from izihawa_commons.schedule.host_manager import HostManager
-from six import PY3, string_types
+from six import PY3, string_types, text_type
+from six.moves import queue
 
+try:
+    import numpy
+except ImportError:
+    numpy = None  # select_columns is unavailable
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None  # select_arrow and exports through pyarrow are unavailable
+
+from .balancing import HOST_SELECTORS
+from .cache import CachedResponse, RecordingResponse, ResultCache, SingleFlight
+from .compression import available_codecs, compress, compress_stream
+from .connections import ConnectionStats, CountingHTTPAdapter
+from .fields import DateTimeField
 from .models import ModelBase
-from .utils import parse_tsv, prepend_if_not
+from .utils import BinaryReader, iter_tsv_rows, parse_tsv_rows, read_tsv_rows, write_string, write_varint
 
 Page = namedtuple('Page', 'objects number_of_objects pages_total number page_size')
+# successes is the list of hosts which executed the query, errors maps failed hosts to exceptions
+BroadcastResult = namedtuple('BroadcastResult', 'successes errors')
+# Buffered rows of a model are flushed when any of the limits is reached, None means no limit
+FlushPolicy = namedtuple('FlushPolicy', 'max_rows max_bytes max_latency_ms')
+FlushPolicy.__new__.__defaults__ = (None, None, None)
+
+INSERT_FORMATS = ('TabSeparated', 'RowBinary')
+SELECT_FORMATS = ('TabSeparatedWithNamesAndTypes', 'RowBinaryWithNamesAndTypes')
+SEND_QUEUE_POLICIES = ('block', 'drop_oldest', 'raise')
+BINARY_CHUNK_SIZE = 64 * 1024
+FILE_CHUNK_SIZE = 1024 * 1024
+ARROW_EXPORT_FORMATS = ('Arrow', 'Parquet')
+# Default number of caller threads sending queries at once with threaded=True
+THREADED_CONCURRENCY = 64
+# Number of KILL queries of hedged reads sent at once
+KILL_CONCURRENCY = 8
+# Before urllib3 2, readinto of a decoded response fails when the decoded data
+# is larger than the buffer
+READINTO_DECODES = int(urllib3.__version__.split('.')[0]) >= 2
+# Settings of Native selects: plain values for LowCardinality columns
+NATIVE_SETTINGS = {'low_cardinality_allow_in_native_format': 0}
+# Formats with a row per line, which insert_file can split at line ends
+# (not CSV, as quoted values may contain newlines)
+SPLITTABLE_FORMATS = ('TabSeparated', 'TSV', 'TabSeparatedRaw', 'JSONEachRow', 'TSKV')
 
 
 class DatabaseException(Exception):
@@ -25,188 +77,986 @@ class InconsistentConfig(DatabaseException):
     pass
 
 
+class SendQueueFull(DatabaseException):
+    pass
+
+
+class UnsupportedType(DatabaseException):
+    pass
+
+
 error_log = logging.getLogger('clickhouse.error')
 
 
-class Database(object):
+class InsertBuffer(object):
+    '''
+    Rows of one model waiting to be inserted. Rows are encoded in the insert format
+    as they arrive and accumulated in a single growing stream, so that no Python
+    objects are kept per row and the stream itself becomes the body of the INSERT.
+    '''
+
+    def __init__(self, model_class, insert_format):
+        self.model_class = model_class
+        self.insert_format = insert_format
+        self.lock = Lock()
+        self.rows = 0
+        self.size = 0
+        self.first_row_time = None
+        self._data = io.BytesIO()
+
+    def append(self, data, rows):
+        '''
+        Adds encoded rows to the buffer. Returns True if the buffer was empty before.
+        '''
+        with self.lock:
+            was_empty = not self.rows
+            if was_empty:
+                self.first_row_time = time.time()
+            self._data.write(data)
+            self.rows += rows
+            self.size += len(data)
+        return was_empty
+
+    def release(self):
+        '''
+        Empties the buffer and returns its encoded rows as a file object positioned
+        at the start, or None if the buffer is empty.
+        '''
+        return self.take()[0]
+
+    def take(self):
+        '''
+        Like release, but returns (data, rows, first_row_time) so that the rows can be
+        put back with restore. Data is None if the buffer is empty.
+        '''
+        with self.lock:
+            if not self.rows:
+                return None, 0, None
+            taken = (self._data, self.rows, self.first_row_time)
+            self._data = io.BytesIO()
+            self.rows = 0
+            self.size = 0
+            self.first_row_time = None
+        taken[0].seek(0)
+        return taken
+
+    def restore(self, data, rows, first_row_time):
+        '''
+        Puts rows taken from the buffer back in front of the rows appended since.
+        '''
+        with self.lock:
+            restored = io.BytesIO()
+            restored.write(data.getvalue())
+            restored.write(self._data.getvalue())
+            self._data = restored
+            self.rows += rows
+            self.size = restored.tell()
+            if self.first_row_time is None or first_row_time < self.first_row_time:
+                self.first_row_time = first_row_time
+
+    def time_left(self, policy, now):
+        '''
+        Returns the number of seconds until the buffer must be flushed according to
+        the policy (zero or less if it is due already), or None if it may wait forever.
+        '''
+        if not self.rows:
+            return None
+        if policy.max_rows is not None and self.rows >= policy.max_rows:
+            return 0
+        if policy.max_bytes is not None and self.size >= policy.max_bytes:
+            return 0
+        if policy.max_latency_ms is not None:
+            return self.first_row_time + policy.max_latency_ms / 1000.0 - now
+        return None
+
+
+class BaseDatabase(object):
+    '''
+    Configuration, host topology and serialization shared by the blocking
+    and the asyncio clients. Subclasses implement the transport.
+    '''
+
     def __init__(
             self,
             topology,
             database_name,
             username=None,
             password=None,
-            retries_per_host=2,
             backoff=None,
             buffer_size=0,
             timeout=None,
-            requests_config=None,
-            wait_for_databases_init_time=300,
             threaded=False,
+            insert_format='TabSeparated',
+            select_format='TabSeparatedWithNamesAndTypes',
+            validate_selects=False,
+            host_selection='random',
     ):
         self._host_manager = HostManager(threaded=threaded)
+        self._host_selector = HOST_SELECTORS[
+            self._check_choice(host_selection, sorted(HOST_SELECTORS))
+        ](self._host_manager)
         self._topology = topology
         self._database_name = database_name
 
         self._username = username
         self._password = password
 
-        self._retries_per_host = retries_per_host
-
         if backoff is None:
             backoff = ExponentialBackoff(1, 2, 512, threaded=threaded)
         self._backoff = backoff
 
         self._buffer_size = buffer_size
         self._timeout = timeout
-        self._requests_config = requests_config or {}
+        self._insert_format = self._check_choice(insert_format, INSERT_FORMATS)
+        self._select_format = self._check_choice(select_format, SELECT_FORMATS)
+        # Selected values are typed by the server, so by default they are only converted
+        self._validate_selects = validate_selects
 
         self._buffer = {}
-        self._buffer_lock = {}
-        self._init_lock = Lock()
 
+        # The timezone of the server (from X-ClickHouse-Timezone headers), in which DateTime
+        # values of binary formats are decoded as in text formats
+        self._server_timezone = None
+
+        self._host_priorities = {}
+        # Ends of the cooldowns of hosts, as HostManager does not expose them
+        self._cooldown_ends = {}
         self._load_hosts(self._topology)
 
+    def _substitute(self, query, model_class=None):
+        '''
+        Replaces $db and $table placeholders in the query.
+        '''
+        if '$' in query:
+            mapping = dict(db="`%s`" % self._database_name)
+            if model_class:
+                mapping['table'] = "`%s`.`%s`" % (
+                    self._database_name,
+                    model_class.table_name()
+                )
+            query = Template(query).substitute(mapping)
+        return query
+
+    @staticmethod
+    def _check_choice(value, choices):
+        '''
+        Returns the value of a setting (a format, a codec, a policy...) if it is one
+        of the choices, raises InconsistentConfig otherwise.
+        '''
+        if value not in choices:
+            raise InconsistentConfig(
+                '%r is not one of %s' % (value, ', '.join(choices))
+            )
+        return value
+
+    @staticmethod
+    def _encode_instances(instances, insert_format):
+        '''
+        Serializes model instances into the body of an INSERT query.
+        '''
+        if insert_format == 'RowBinary':
+            return b''.join(instance.to_rowbinary() for instance in instances)
+        return b''.join(instance.to_tsv().encode('utf-8') + b'\n' for instance in instances)
+
+    @staticmethod
+    def _encode_columns(model_class, columns):
+        '''
+        Serializes a dict of columns into a Native block, returning the INSERT query
+        template and its body, or None if there are no rows.
+        '''
+        if numpy is None:
+            raise ImportError('insert_columns requires numpy')
+        fields = dict(model_class._fields)
+        for name in columns:
+            if name not in fields:
+                raise AttributeError(
+                    '%s does not have a field called %s' % (model_class.__name__, name)
+                )
+        names = [name for name, field in model_class._fields if name in columns]
+        num_rows = set(len(columns[name]) for name in names)
+        if len(num_rows) > 1:
+            raise ValueError('Columns must have the same length')
+        num_rows = num_rows.pop() if num_rows else 0
+        if num_rows == 0:
+            return None
+        body = [write_varint(len(names)), write_varint(num_rows)]
+        for name in names:
+            field = fields[name]
+            body.append(write_string(name))
+            body.append(write_string(field.get_sql(with_default=False)))
+            body.append(field.write_column(columns[name]))
+        return 'INSERT INTO $table (%s) FORMAT Native' % ', '.join(names), b''.join(body)
+
+    @staticmethod
+    def _collect_broadcast(outcomes, ensure):
+        '''
+        Builds a BroadcastResult from (host, exception or None) pairs. With ensure,
+        the first error is raised instead.
+        '''
+        successes = []
+        errors = OrderedDict()
+        for target_host, ex in outcomes:
+            if ex is None:
+                successes.append(target_host)
+                continue
+            error_log.error(
+                'Error while requesting to %s: %s',
+                target_host,
+                str(ex),
+            )
+            errors[target_host] = ex
+        if ensure and errors:
+            raise next(iter(errors.values()))
+        return BroadcastResult(successes, errors)
+
+    def _note_server_timezone(self, headers):
+        name = headers.get('X-ClickHouse-Timezone')
+        if name and (self._server_timezone is None or self._server_timezone.zone != name):
+            self._server_timezone = pytz.timezone(name)
+
+    @staticmethod
+    def _read_rowbinary_header(reader, model_class, server_timezone=None):
+        '''
+        Reads the header of a RowBinaryWithNamesAndTypes response. Returns the model class
+        (an ad hoc one if model_class is None) and the (name, field) pairs to decode rows with.
+        '''
+        num_columns = reader.read_varint()
+        field_names = [reader.read_string() for _ in range(num_columns)]
+        field_types = [reader.read_string() for _ in range(num_columns)]
+        model_fields = dict(model_class._fields) if model_class else {}
+        model_class = model_class or ModelBase.create_ad_hoc_model(zip(field_names, field_types))
+        columns = [
+            (name, BaseDatabase._column_field(model_fields, name, db_type, server_timezone))
+            for name, db_type in zip(field_names, field_types)
+        ]
+        return model_class, columns
+
+    @staticmethod
+    def _column_field(model_fields, name, db_type, server_timezone=None):
+        '''
+        Returns the field to decode the column with, see _decoding_field. Raises
+        UnsupportedType if no field can decode its type.
+        '''
+        try:
+            return BaseDatabase._decoding_field(model_fields.get(name), db_type, server_timezone)
+        except NotImplementedError:
+            raise UnsupportedType(
+                'Column %s has type %s, which can not be decoded; convert it in the query '
+                '(e.g. with toString)' % (name, db_type)
+            )
+
+    @staticmethod
+    def _decoding_field(model_field, db_type, server_timezone=None):
+        '''
+        Returns the field to decode a column of db_type with: the model's own field if it
+        declares the column with that type, an ad hoc field for the type otherwise.
+        LowCardinality columns are sent as their values, so it is ignored. DateTime values
+        are read in the server's timezone (local time if it is unknown), DateTime('tz')
+        values in the column's.
+        '''
+        if db_type.startswith('LowCardinality('):
+            db_type = db_type[15:-1]
+        if db_type == 'DateTime':
+            return DateTimeField(timezone=server_timezone)
+        if model_field is not None and model_field.get_sql(with_default=False) == db_type:
+            return model_field
+        return ModelBase.create_ad_hoc_field(db_type)
+
+    @staticmethod
+    def _aggregate_sql(model_class, group_by, sums, avgs, uniqs, conditions, sample):
+        '''
+        Builds the query of Database.aggregate. Sampled sums and counts are multiplied by
+        _sample_factor, so they estimate the values of the whole table.
+        '''
+        field_names = set(name for name, field in model_class._fields)
+        for name in itertools.chain(sums, avgs, uniqs):
+            if name not in field_names:
+                raise AttributeError(
+                    '%s does not have a field called %s' % (model_class.__name__, name)
+                )
+        factor = ''
+        count = 'count()'
+        if sample is not None:
+            if not getattr(model_class.engine, 'sampling_expr', None):
+                raise ValueError('%s has no sampling expression' % model_class.__name__)
+            factor = ' * _sample_factor'
+            count = 'sum(_sample_factor)'
+        columns = list(group_by)
+        columns.append('%s AS count' % count)
+        columns.extend('sum(%s%s) AS sum_%s' % (name, factor, name) for name in sums)
+        columns.extend('avg(%s) AS avg_%s' % (name, name) for name in avgs)
+        columns.extend('uniq(%s) AS uniq_%s' % (name, name) for name in uniqs)
+        query = 'SELECT %s FROM $table' % ', '.join(columns)
+        if sample is not None:
+            query += ' SAMPLE %s' % sample
+        if conditions:
+            query += ' WHERE ' + conditions
+        if group_by:
+            query += ' GROUP BY %s ORDER BY %s' % (', '.join(group_by), ', '.join(group_by))
+        return query
+
+    def host_stats(self):
+        '''
+        Returns the metrics of the hosts queries were sent to: the numbers of requests,
+        errors and requests in flight, and the average time to response headers (latency_ms).
+        '''
+        return self._host_selector.stats()
+
+    def _add_host(self, priority, host):
+        if '://' not in host:
+            host = 'http://' + host
+        self._host_priorities[host] = priority
+        self._host_manager.add(priority, host)
+
+    def _cool_down_host(self, target_host, seconds):
+        self._host_manager.cooldown(target_host, seconds)
+        self._cooldown_ends[target_host] = time.time() + seconds
+
+    def _is_available(self, target_host, now=None):
+        return self._cooldown_ends.get(target_host, 0) <= (now or time.time())
+
+    def _top_priority_hosts(self):
+        '''
+        Returns the available hosts with the highest priority (the lowest value), which
+        serve all queries while they are available, or an empty list if all hosts are
+        cooling down.
+        '''
+        now = time.time()
+        available = dict(
+            (host, priority) for host, priority in self._host_priorities.items()
+            if self._is_available(host, now)
+        )
+        if not available:
+            return []
+        top = min(available.values())
+        return sorted(host for host, priority in available.items() if priority == top)
+
+    def _load_hosts(self, new_hosts):
+        if len(new_hosts) == 0:
+            return
+
+        if len(self._host_manager.hosts_set()) != 0 and type(new_hosts) in {set, str, list}:
+            raise ValueError('Priority is not specified for new hosts')
+
+        if isinstance(new_hosts, list):
+            for priority, new_host in enumerate(new_hosts):
+                self._add_host(priority, new_host)
+        elif isinstance(new_hosts, set):
+            for new_host in new_hosts:
+                self._add_host(1, new_host)
+        elif isinstance(new_hosts, dict):
+            values = list(new_hosts.items())
+            if isinstance(values[0][0], int) and isinstance(values[0][1], list):
+                for priority, nested_new_hosts in values:
+                    for new_host in nested_new_hosts:
+                        self._add_host(priority, new_host)
+            elif isinstance(values[0][0], str) and isinstance(values[0][1], int):
+                for new_host, priority in values:
+                    self._add_host(priority, new_host)
+            else:
+                raise InconsistentConfig(
+                    'Dict object must be in format <int, list<str>> or <str, int>'
+                )
+        elif isinstance(new_hosts, str):
+            self._add_host(1, new_hosts)
+        else:
+            raise InconsistentConfig('Passed hosts must be a list, set, string or dict object')
+
+
+class Database(BaseDatabase):
+    def __init__(
+            self,
+            topology,
+            database_name,
+            username=None,
+            password=None,
+            retries_per_host=2,
+            backoff=None,
+            buffer_size=0,
+            timeout=None,
+            requests_config=None,
+            wait_for_databases_init_time=300,
+            threaded=False,
+            insert_format='TabSeparated',
+            select_format='TabSeparatedWithNamesAndTypes',
+            validate_selects=False,
+            host_selection='random',
+            broadcast_concurrency=16,
+            flush_policy=None,
+            flush_policies=None,
+            sender_workers=0,
+            send_queue_size=64,
+            send_queue_policy='block',
+            request_compression=None,
+            response_compression=None,
+            compression_level=None,
+            prewarm_connections=0,
+            hedge_delay=None,
+            hedge_percentile=None,
+            cache_ttl=None,
+            cache_max_bytes=64 * 1024 * 1024,
+            coalesce_reads=False,
+            concurrency=None,
+    ):
+        super(Database, self).__init__(
+            topology,
+            database_name,
+            username=username,
+            password=password,
+            backoff=backoff,
+            buffer_size=buffer_size,
+            timeout=timeout,
+            threaded=threaded,
+            insert_format=insert_format,
+            select_format=select_format,
+            validate_selects=validate_selects,
+            host_selection=host_selection,
+        )
+        self._retries_per_host = retries_per_host
+        self._requests_config = requests_config or {}
+
+        # Hedged reads, see _read_query
+        self._hedge_delay = hedge_delay
+        self._hedge_percentile = hedge_percentile
+        # Responses of reads are cached only with a TTL
+        self._result_cache = ResultCache(cache_ttl, cache_max_bytes) if cache_ttl else None
+        # Identical reads in flight at the same time are sent once
+        self._single_flight = SingleFlight() if coalesce_reads else None
+
+        if concurrency is None:
+            concurrency = THREADED_CONCURRENCY if threaded else 1
+
+        # Broadcast and prewarming requests go to one executor, the attempts of hedged reads
+        # and their KILL queries to others created on first use (see _get_hedge_executors),
+        # with room for two attempts per concurrent read and for attempts which lost
+        self._init_lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=broadcast_concurrency)
+        self._hedge_concurrency = max(THREADED_CONCURRENCY, 2 * concurrency)
+        self._hedge_executor = None
+        self._kill_executor = None
+
+        # Models without a policy are flushed by the flusher once they exceed buffer_size
+        self._flush_policy = flush_policy or FlushPolicy(max_rows=buffer_size + 1)
+        self._flush_policies = flush_policies or {}
+        self._flusher = None
+        if flush_policy or flush_policies:
+            self._flusher_wakeup = Event()
+            self._flusher_stop = Event()
+            self._flusher = Thread(target=self._flush_loop, name='clickhouse-flusher')
+            self._flusher.daemon = True
+
+        # With sender workers, released buffers are queued and sent by the workers
+        self._send_queue_policy = self._check_choice(send_queue_policy, SEND_QUEUE_POLICIES)
+        self._send_queue = queue.Queue(maxsize=send_queue_size)
+        self._send_stats = dict(enqueued=0, sent=0, failed=0, dropped=0, rejected=0)
+        self._send_stats_lock = Lock()
+        self._senders = []
+        for i in range(sender_workers):
+            sender = Thread(target=self._send_loop, name='clickhouse-sender-%d' % i)
+            sender.daemon = True
+            self._senders.append(sender)
+
+        # One pool per host, each keeping as many connections as the client may use
+        # at once: the callers' threads, the broadcast executor threads and the sender workers
         self._requests_pool_connections = self._requests_config.get(
             'pool_connections',
             len(self._host_manager.hosts_set())
         )
         self._requests_pool_maxsize = self._requests_config.get(
             'pool_maxsize',
-            len(self._host_manager.hosts_set())
+            max(requests.adapters.DEFAULT_POOLSIZE, concurrency + broadcast_concurrency + sender_workers)
         )
 
+        self._connection_stats = ConnectionStats()
         self._requests_session = requests.Session()
-        a = requests.adapters.HTTPAdapter(
-            pool_connections=self._requests_pool_maxsize,
-            pool_maxsize=self._requests_pool_connections,
+        a = CountingHTTPAdapter(
+            self._connection_stats,
+            pool_connections=self._requests_pool_connections,
+            pool_maxsize=self._requests_pool_maxsize,
+            pool_block=self._requests_config.get('pool_block', False),
             max_retries=self._retries_per_host,
         )
         self._requests_session.mount('http://', a)
+        self._requests_session.mount('https://', a)
 
         self._requests_params = {
             'user': self._username,
             'password': self._password,
         }
 
+        # Request bodies (rows of INSERT queries) are compressed by the client
+        self._request_compression = request_compression
+        self._compression_level = compression_level
+        if request_compression:
+            self._check_choice(request_compression, available_codecs())
+        # Responses are compressed by ClickHouse and decoded by urllib3 while streaming
+        if response_compression:
+            self._check_choice(response_compression, urllib3.response.HTTPResponse.CONTENT_DECODERS)
+            self._requests_params['enable_http_compression'] = 1
+            self._requests_session.headers['Accept-Encoding'] = response_compression
+
         self.create_database(timeout=wait_for_databases_init_time)
+        if prewarm_connections:
+            self.prewarm_connections(prewarm_connections)
+        if self._flusher:
+            self._flusher.start()
+        for sender in self._senders:
+            sender.start()
 
     def query(
             self,
             query,
             stream_response=False,
             timeout=None,
+            data=None,
+            host=None,
+            settings=None,
     ):
+        '''
+        Sends the query to one of the available hosts, or first to host if it is given
+        (retries still go to the available hosts). Settings ({name: value}) are sent
+        as URL parameters and apply to this query only. When data is passed, the query
+        goes to the URL and data is sent as the request body (e.g. rows for INSERT).
+        Data may also be a seekable file object, it is rewound before every attempt,
+        or a function returning an iterable of chunks, it is called before every attempt
+        and the chunks are sent with chunked transfer encoding.
+        With request_compression, data is compressed once before sending (chunks are
+        compressed as they are sent).
+        '''
         timeout = timeout or self._timeout
-        if PY3 and isinstance(query, string_types):
-            query = query.encode('utf-8')
+        params = self._requests_params
+        if settings:
+            params = dict(params, **settings)
+        headers = None
+        if data is None:
+            data = query
+        else:
+            params = dict(params, query=query)
+            if self._request_compression:
+                headers = {'Content-Encoding': self._request_compression}
+                if callable(data):
+                    data = self._compressed_chunks(data)
+                else:
+                    data = compress(data, self._request_compression, self._compression_level)
+        if PY3 and isinstance(data, string_types):
+            data = data.encode('utf-8')
         while True:
-            target_host = self._host_manager.get()
+            target_host = host or self._host_selector.select()
+            host = None
+            if hasattr(data, 'seek'):
+                data.seek(0)
+            body = data() if callable(data) else data
+            started = self._host_selector.start(target_host)
+            failed = True
             try:
                 r = self._requests_session.post(
                     target_host,
-                    params=self._requests_params,
-                    data=query,
+                    params=params,
+                    data=body,
+                    headers=headers,
                     timeout=timeout,
                     stream=stream_response,
                 )
                 if r.status_code == 200:
+                    failed = False
                     self._backoff.reset(target_host)
                     return r
                 else:
                     raise DatabaseException(r.text)
             except (requests.RequestException, DatabaseException) as ex:
-                error_log.error(
-                    'Error while requesting to %s: %s',
-                    target_host,
-                    ex,
-                )
-                bo = self._backoff(target_host)
-                self._host_manager.cooldown(target_host, bo)
-                error_log.error(
-                    'Host %s is cooling down for %d seconds',
-                    target_host,
-                    bo,
-                )
+                self._cool_down(target_host, ex)
+            finally:
+                self._host_selector.finish(target_host, started, failed)
+
+    def _cool_down(self, target_host, ex):
+        error_log.error(
+            'Error while requesting to %s: %s',
+            target_host,
+            ex,
+        )
+        bo = self._backoff(target_host)
+        self._cool_down_host(target_host, bo)
+        error_log.error(
+            'Host %s is cooling down for %d seconds',
+            target_host,
+            bo,
+        )
+
+    def _get_hedge_delay(self):
+        if self._hedge_percentile is not None:
+            latency_ms = self._host_selector.latency_percentile(self._hedge_percentile)
+            if latency_ms is not None:
+                return latency_ms / 1000.0
+        return self._hedge_delay
+
+    def _read_query(self, query, stream_response=False, timeout=None, use_cache=True, coalesce=False):
+        '''
+        Sends a read-only query. With cache_ttl, the response body is cached under the
+        query (after substitution), the database and the user once it has been read, if it
+        takes at most cache_max_bytes, and repeated queries get a CachedResponse instead
+        unless use_cache is false. Streamed responses stay streamed while being cached.
+        With coalesce_reads and coalesce, a query identical to one in flight is not sent:
+        it waits for the body of the other one, which is read at once, and gets it as a
+        CachedResponse.
+        '''
+        cache = self._result_cache if use_cache else None
+        single_flight = self._single_flight if coalesce else None
+        if cache is None and single_flight is None:
+            return self._send_read(query, stream_response, timeout)
+        key = (self._database_name, self._username, query)
+        content = cache.get(key) if cache else None
+        if content is not None:
+            return CachedResponse(content)
+        if single_flight is not None:
+            content = single_flight.do(key, lambda: self._fetch_content(key, query, timeout, cache))
+            return CachedResponse(content)
+        r = self._send_read(query, stream_response, timeout)
+        if not stream_response:
+            cache.put(key, r.content)
+            return r
+        return RecordingResponse(r, cache.max_bytes, lambda content: cache.put(key, content))
+
+    def _fetch_content(self, key, query, timeout, cache):
+        r = self._send_read(query, True, timeout)
+        try:
+            content = r.content
+        finally:
+            r.close()
+        if cache:
+            cache.put(key, content)
+        return content
+
+    def cache_stats(self):
+        '''
+        Returns the counters of the result cache (None without cache_ttl): hits, misses,
+        evictions, and the current number of entries and their size in bytes.
+        '''
+        return self._result_cache.stats() if self._result_cache else None
+
+    def coalescing_stats(self):
+        '''
+        Returns the numbers of reads sent (leaders) and of reads which shared the
+        response of an identical one in flight (followers), None without coalesce_reads.
+        '''
+        return self._single_flight.stats() if self._single_flight else None
+
+    def clear_cache(self):
+        if self._result_cache:
+            self._result_cache.clear()
+
+    def _send_read(self, query, stream_response, timeout):
+        '''
+        Sends a read-only query, hedged when hedge_delay or hedge_percentile is set:
+        if the host has not responded within the delay (in seconds, or the given
+        percentile of recent response times), the query is also sent to another host
+        of the same priority. The first response is used and the other query is killed.
+        '''
+        delay = self._get_hedge_delay()
+        if delay is None:
+            return self.query(query, stream_response=stream_response, timeout=timeout)
+        timeout = timeout or self._timeout
+        attempts = {}
+
+        def send(target_host):
+            query_id = str(uuid.uuid4())
+            future = self._get_hedge_executors()[0].submit(
+                self._send_attempt, target_host, query, query_id, stream_response, timeout
+            )
+            attempts[future] = (target_host, query_id)
+
+        primary_host = self._host_selector.select()
+        send(primary_host)
+        done, pending = wait(list(attempts), timeout=delay)
+        if not done or list(done)[0].exception() is not None:
+            hedge_host = self._hedge_host(primary_host)
+            if hedge_host is not None:
+                send(hedge_host)
+        winner = None
+        pending = set(attempts)
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    self._cool_down(attempts[future][0], future.exception())
+                elif winner is None:
+                    winner = future
+        for future in pending:
+            self._cancel_attempt(future, *attempts[future])
+        for future in done:
+            if future is not winner and future.exception() is None:
+                future.result().close()
+        if winner is None:
+            # Every attempt failed, fall back to the usual retries
+            return self.query(query, stream_response=stream_response, timeout=timeout)
+        return winner.result()
+
+    def _hedge_host(self, primary_host):
+        '''
+        Returns a random available host with the priority of the primary host
+        other than itself, or None if there is none.
+        '''
+        priority = self._host_priorities.get(primary_host)
+        now = time.time()
+        candidates = [
+            host for host, host_priority in self._host_priorities.items()
+            if host_priority == priority and host != primary_host and self._is_available(host, now)
+        ]
+        return random.choice(candidates) if candidates else None
+
+    def _get_hedge_executors(self):
+        '''
+        Returns the executors of the attempts of hedged reads and of their KILL queries,
+        created on first use. KILLs have their own, so that they never wait for attempts
+        which lost and keep waiting for a slow host.
+        '''
+        if self._hedge_executor is None:
+            with self._init_lock:
+                if self._hedge_executor is None:
+                    self._kill_executor = ThreadPoolExecutor(max_workers=KILL_CONCURRENCY)
+                    self._hedge_executor = ThreadPoolExecutor(max_workers=self._hedge_concurrency)
+        return self._hedge_executor, self._kill_executor
+
+    def _send_attempt(self, target_host, query, query_id, stream_response, timeout):
+        started = self._host_selector.start(target_host)
+        failed = True
+        try:
+            r = self._requests_session.post(
+                target_host,
+                params=dict(self._requests_params, query_id=query_id),
+                data=query.encode('utf-8'),
+                timeout=timeout,
+                stream=stream_response,
+            )
+            if r.status_code != 200:
+                raise DatabaseException(r.text)
+            failed = False
+            self._backoff.reset(target_host)
+            return r
+        finally:
+            self._host_selector.finish(target_host, started, failed)
+
+    def _cancel_attempt(self, future, target_host, query_id):
+        # The response is closed whenever it arrives, the query is killed meanwhile
+        future.add_done_callback(lambda f: f.exception() is None and f.result().close())
+        self._get_hedge_executors()[1].submit(self._kill_query, target_host, query_id)
+
+    def _kill_query(self, target_host, query_id):
+        try:
+            self._post_to_host(
+                target_host,
+                "KILL QUERY WHERE query_id = '%s' ASYNC" % query_id,
+                self._timeout,
+            )
+        except (requests.RequestException, DatabaseException) as ex:
+            error_log.error('Error while killing query %s on %s: %s', query_id, target_host, ex)
+
+    def _compressed_chunks(self, make_chunks):
+        codec = self._request_compression
+        level = self._compression_level
+        return lambda: compress_stream(make_chunks(), codec, level)
+
+    def _post_to_host(self, target_host, query, timeout):
+        r = self._requests_session.post(
+            target_host,
+            params=self._requests_params,
+            data=query,
+            timeout=timeout,
+        )
+        r.close()
+        if r.status_code != 200:
+            raise DatabaseException(r.text)
+        self._note_server_timezone(r.headers)
 
     def broadcast_query(self, query, ensure=True, timeout=None):
-        success_counter = 0
+        '''
+        Sends the query to all hosts concurrently, at most broadcast_concurrency at once.
+        Returns a BroadcastResult; with ensure, the first error is raised instead.
+        '''
         timeout = timeout or self._timeout
-        for target_host in self._host_manager.hosts_set():
+        hosts = sorted(self._host_manager.hosts_set())
+        futures = [
+            self._executor.submit(self._post_to_host, target_host, query, timeout)
+            for target_host in hosts
+        ]
+        outcomes = []
+        for target_host, future in zip(hosts, futures):
             try:
-                r = self._requests_session.post(
-                    target_host,
-                    params=self._requests_params,
-                    data=query,
-                    timeout=timeout,
-                )
-                r.close()
-                if r.status_code == 200:
-                    success_counter += 1
-                    continue
-                else:
-                    raise DatabaseException(r.text)
+                future.result()
+                outcomes.append((target_host, None))
             except (requests.RequestException, DatabaseException) as ex:
-                error_log.error(
-                    'Error while requesting to %s: %s',
-                    target_host,
-                    str(ex),
-                )
-                if ensure:
-                    raise ex
-        return success_counter
+                outcomes.append((target_host, ex))
+        return self._collect_broadcast(outcomes, ensure)
 
     def flush(self):
-        for model_class in self._buffer:
-            self._send_instances(
-                model_class,
-                self._try_release_buffer(model_class, force=True),
-            )
+        '''
+        Sends all buffered rows and, with sender workers, waits until they are sent
+        (and, whatever send_queue_policy is, until the queue has room for them).
+        '''
+        for insert_buffer in list(self._buffer.values()):
+            self._send_buffer(insert_buffer, block=True)
+        if self._senders:
+            self._send_queue.join()
 
-    def _init_buffer(self, model_class):
-        if model_class not in self._buffer:
+    def _get_buffer(self, model_class, insert_format):
+        key = (model_class, insert_format)
+        if key not in self._buffer:
             with self._init_lock:
-                if model_class not in self._buffer:
-                    self._buffer[model_class] = []
-                    self._buffer_lock[model_class] = Lock()
-
-    def _try_release_buffer(self, model_class, force=False):
-        if force or len(self._buffer[model_class]) > self._buffer_size:
-            with self._buffer_lock[model_class]:
-                if len(self._buffer[model_class]) > 0:
-                    buffer_values = self._buffer[model_class]
-                    self._buffer[model_class] = []
-                    return buffer_values
-                else:
-                    return
-        else:
+                if key not in self._buffer:
+                    self._buffer[key] = InsertBuffer(model_class, insert_format)
+        return self._buffer[key]
+
+    def _send_buffer(self, insert_buffer, block=False):
+        data, rows, first_row_time = insert_buffer.take()
+        if data is None:
             return
+        batch = (insert_buffer.model_class, insert_buffer.insert_format, data)
+        if not self._senders:
+            self._send_batch(*batch)
+            return
+        if block:
+            self._send_queue.put(batch)
+            self._count_send('enqueued')
+            return
+        try:
+            self._enqueue_batch(batch)
+        except SendQueueFull:
+            # The rows stay buffered, with the rows of other callers, until a later flush
+            insert_buffer.restore(data, rows, first_row_time)
+            raise
+
+    def _send_batch(self, model_class, insert_format, data):
+        query = self._substitute('INSERT INTO $table FORMAT %s' % insert_format, model_class)
+        r = self.query(query, data=data)
+        r.close()
+
+    def _count_send(self, name):
+        with self._send_stats_lock:
+            self._send_stats[name] += 1
 
-    def _send_instances(self, model_class, instances):
-        if instances and len(instances) > 0:
-            query = [
-                self._substitute(
-                    'INSERT INTO $table FORMAT TabSeparated',
-                    model_class
-                ).encode('utf-8')
-            ]
-            for instance in instances:
-                query.append(instance.to_tsv().encode('utf-8'))
-            r = self.query('\n'.encode('utf-8').join(query))
+    def _enqueue_batch(self, batch):
+        '''
+        Puts an encoded batch into the send queue. When the queue is full, depending
+        on send_queue_policy this blocks, drops the oldest batch or raises SendQueueFull
+        (the batch is then not queued, _send_buffer puts its rows back in the buffer).
+        '''
+        if self._send_queue_policy == 'block':
+            self._send_queue.put(batch)
+        elif self._send_queue_policy == 'raise':
+            try:
+                self._send_queue.put_nowait(batch)
+            except queue.Full:
+                self._count_send('rejected')
+                raise SendQueueFull('Send queue is full (%d batches)' % self._send_queue.maxsize)
+        else:
+            while True:
+                try:
+                    self._send_queue.put_nowait(batch)
+                    break
+                except queue.Full:
+                    try:
+                        self._send_queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    self._send_queue.task_done()
+                    self._count_send('dropped')
+                    error_log.error('Send queue is full, dropped the oldest batch')
+        self._count_send('enqueued')
+
+    def _send_loop(self):
+        '''
+        Body of a sender worker thread; a None batch stops it.
+        '''
+        while True:
+            batch = self._send_queue.get()
+            try:
+                if batch is None:
+                    return
+                self._send_batch(*batch)
+                self._count_send('sent')
+            except Exception as ex:
+                self._count_send('failed')
+                error_log.error('Error while sending %s: %s', batch[0].__name__, ex)
+            finally:
+                self._send_queue.task_done()
+
+    def connection_stats(self):
+        '''
+        Returns connection pool counters per host: requests sent over a reused
+        connection (hits), requests which had to connect (misses), connections opened
+        and connections discarded because the host's pool was full.
+        '''
+        return self._connection_stats.snapshot()
+
+    def prewarm_connections(self, connections, timeout=None):
+        '''
+        Opens up to the given number of connections to every host of the highest priority
+        by pinging them, so that the first queries reuse them. Failures are only logged.
+        '''
+        timeout = timeout or self._timeout
+        futures = [
+            self._executor.submit(self._prewarm_host, target_host, connections, timeout)
+            for target_host in self._top_priority_hosts()
+        ]
+        for future in futures:
+            future.result()
+
+    def _prewarm_host(self, target_host, connections, timeout):
+        responses = []
+        try:
+            # Unread responses hold their connections, so every ping opens a new one
+            for _ in range(connections):
+                responses.append(self._requests_session.get(
+                    target_host + '/ping',
+                    timeout=timeout,
+                    stream=True,
+                ))
+        except requests.RequestException as ex:
+            error_log.error('Error while prewarming connections to %s: %s', target_host, ex)
+        for r in responses:
+            # Reading the body releases the connection back to the pool
+            r.content
             r.close()
 
-    def _substitute(self, query, model_class=None):
+    def send_queue_stats(self):
         '''
-        Replaces $db and $table placeholders in the query.
+        Returns counters of the send queue: the current depth and the numbers of
+        enqueued, sent, failed, dropped and rejected batches.
         '''
-        if '$' in query:
-            mapping = dict(db="`%s`" % self._database_name)
-            if model_class:
-                mapping['table'] = "`%s`.`%s`" % (
-                    self._database_name,
-                    model_class.table_name()
-                )
-            query = Template(query).substitute(mapping)
-        return query
+        with self._send_stats_lock:
+            stats = dict(self._send_stats)
+        stats['depth'] = self._send_queue.qsize()
+        return stats
+
+    def _get_flush_policy(self, model_class):
+        return self._flush_policies.get(model_class, self._flush_policy)
+
+    def _flush_loop(self):
+        '''
+        Body of the background flusher thread. It sleeps until the earliest latency
+        deadline of the buffers or until insert() reports that a buffer is full.
+        '''
+        while not self._flusher_stop.is_set():
+            self._flusher_wakeup.wait(self._flush_due_buffers())
+            self._flusher_wakeup.clear()
+
+    def _flush_due_buffers(self):
+        '''
+        Sends the buffers which are due according to their flush policies. Returns the
+        number of seconds until the next buffer becomes due, or None.
+        '''
+        next_delay = None
+        for insert_buffer in list(self._buffer.values()):
+            policy = self._get_flush_policy(insert_buffer.model_class)
+            delay = insert_buffer.time_left(policy, time.time())
+            if delay is not None and delay <= 0:
+                try:
+                    self._send_buffer(insert_buffer)
+                except Exception as ex:
+                    error_log.error('Error while flushing %s: %s', insert_buffer.model_class.__name__, ex)
+                continue
+            if delay is not None and (next_delay is None or delay < next_delay):
+                next_delay = delay
+        return next_delay
 
     def create_database(self, timeout=None):
         return self.broadcast_query(
@@ -236,69 +1086,449 @@ class Database(object):
             timeout=timeout,
         )
 
-    def insert(self, model_instances):
+    def insert(self, model_instances, insert_format=None):
+        '''
+        Encodes the instances and adds them to the model's buffer. Without flush policies,
+        the buffer is sent right away once it holds more than buffer_size rows; otherwise
+        the background flusher sends it, so insert() never waits for HTTP. Models without
+        a policy then keep the buffer_size limit, unless flush_policy is set.
+        '''
         if isinstance(model_instances, types.GeneratorType):
             model_instances = list(model_instances)
         if len(model_instances) == 0:
             return
         model_class = model_instances[0].__class__
-        self._init_buffer(model_class)
-        with self._buffer_lock[model_class]:
-            self._buffer[model_class].extend(model_instances)
-        self._send_instances(model_class, self._try_release_buffer(model_class))
+        insert_format = self._check_choice(insert_format or self._insert_format, INSERT_FORMATS)
+        insert_buffer = self._get_buffer(model_class, insert_format)
+        was_empty = insert_buffer.append(
+            self._encode_instances(model_instances, insert_format),
+            len(model_instances),
+        )
+        if self._flusher:
+            # Wake the flusher up if the buffer is full or has a new latency deadline
+            delay = insert_buffer.time_left(self._get_flush_policy(model_class), time.time())
+            if was_empty or (delay is not None and delay <= 0):
+                self._flusher_wakeup.set()
+        elif insert_buffer.rows > self._buffer_size:
+            self._send_buffer(insert_buffer)
+
+    def insert_columns(self, model_class, columns):
+        '''
+        Inserts rows given as columns ({field name: sequence or NumPy array}) without
+        creating model instances. Every column is converted and validated at once and
+        sent in the Native format; fields which are not passed get their defaults.
+        The rows are sent immediately, bypassing the buffer.
+        '''
+        encoded = self._encode_columns(model_class, columns)
+        if encoded is None:
+            return
+        query, body = encoded
+        r = self.query(self._substitute(query, model_class), data=body)
+        r.close()
+
+    def insert_file(self, model_class, fileobj, format='TabSeparated', part_size=None, timeout=None):
+        '''
+        Inserts rows from a file object or a path in any ClickHouse input format, without
+        parsing them. The file is sent as a chunked request body read FILE_CHUNK_SIZE bytes
+        at a time, so memory use does not depend on the file size. Seekable files are sent
+        again from the same position when the request is retried, other streams can not be
+        retried.
+
+        With part_size, the file is cut at line ends into parts of about part_size bytes,
+        each inserted by its own query. The parts are assigned to the available hosts of
+        the highest priority in turn and sent in parallel, one per host at once, which is also the
+        number of parts held in memory. Only formats with a row per line
+        (SPLITTABLE_FORMATS) can be split.
+        '''
+        if not hasattr(fileobj, 'read'):
+            with open(fileobj, 'rb') as f:
+                return self.insert_file(model_class, f, format, part_size, timeout)
+        query = self._substitute('INSERT INTO $table FORMAT %s' % format, model_class)
+        if part_size is None:
+            r = self.query(query, timeout=timeout, data=self._file_chunks(fileobj))
+            r.close()
+            return
+        self._check_choice(format, SPLITTABLE_FORMATS)
+        concurrency = max(1, len(self._top_priority_hosts()))
+        futures = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for i, part in enumerate(self._read_parts(fileobj, part_size)):
+                if len(futures) >= concurrency:
+                    futures.pop(0).result()
+                # Hosts which failed meanwhile are cooling down and get no more parts,
+                # without any available host query() picks one as usual
+                hosts = self._top_priority_hosts()
+                target_host = hosts[i % len(hosts)] if hosts else None
+                futures.append(executor.submit(self._insert_part, query, part, timeout, target_host))
+            for future in futures:
+                future.result()
 
-    def select(self, query, model_class=None):
-        query += ' FORMAT TabSeparatedWithNamesAndTypes'
+    def _insert_part(self, query, part, timeout, target_host):
+        self.query(query, timeout=timeout, data=part, host=target_host).close()
+
+    @staticmethod
+    def _file_chunks(fileobj):
+        '''
+        Returns a function for query() which starts reading the file in chunks
+        from its current position.
+        '''
+        seekable = getattr(fileobj, 'seekable', None)
+        start = fileobj.tell() if seekable and seekable() else None
+        started = []
+
+        def iter_chunks():
+            while True:
+                chunk = fileobj.read(FILE_CHUNK_SIZE)
+                if not chunk:
+                    return
+                yield chunk.encode('utf-8') if isinstance(chunk, text_type) else chunk
+
+        def read_chunks():
+            # Called by query() before sending, so a failure here is not retried
+            if start is not None:
+                fileobj.seek(start)
+            elif started:
+                raise DatabaseException('The stream can not be sent again')
+            started.append(True)
+            return iter_chunks()
+
+        return read_chunks
+
+    @staticmethod
+    def _read_parts(fileobj, part_size):
+        '''
+        Reads the file in parts of about part_size bytes ending at line ends.
+        '''
+        while True:
+            part = fileobj.read(part_size)
+            if not part:
+                return
+            if not part.endswith(b'\n' if isinstance(part, bytes) else u'\n'):
+                part += fileobj.readline()
+            yield part.encode('utf-8') if isinstance(part, text_type) else part
+
+    def select(self, query, model_class=None, select_format=None, lightweight=False, validate=None,
+               use_cache=True, coalesce=False):
+        '''
+        Runs the query and yields model instances. Their values are validated only if
+        validate (by default the validate_selects setting) is true. With lightweight,
+        read-only rows of model_class.row_class() are yielded instead, which skip
+        validation and take several times less memory. With cache_ttl, use_cache=False
+        bypasses the result cache. With coalesce_reads, coalesce=True shares the response of
+        an identical query in flight; the response is then read into memory at once.
+        Both select formats return the same values: DateTime values are the naive
+        wall-clock time of the server (of the column's timezone for DateTime('tz')),
+        Float32 values are rounded to their shortest text representation.
+        '''
+        validate = self._validate_selects if validate is None else validate
+        select_format = self._check_choice(select_format or self._select_format, SELECT_FORMATS)
+        query += ' FORMAT ' + select_format
         query = self._substitute(query, model_class)
-        r = self.query(query, stream_response=True)
-        lines = r.iter_lines()
-        field_names = parse_tsv(next(lines))
-        field_types = parse_tsv(next(lines))
-        model_class = model_class or ModelBase.create_ad_hoc_model(zip(field_names, field_types))
-        for line in lines:
-            yield model_class.from_tsv(line, field_names)
+        r = self._read_query(query, stream_response=True, use_cache=use_cache, coalesce=coalesce)
+        if select_format == 'RowBinaryWithNamesAndTypes':
+            # Cached responses have no headers, the timezone was noted when they were received
+            self._note_server_timezone(getattr(r, 'headers', {}))
+            instances = self._iter_rowbinary(r, model_class, lightweight, validate, self._server_timezone)
+        else:
+            instances = self._iter_tsv(r, model_class, lightweight, validate)
+        for instance in instances:
+            yield instance
         r.close()
 
-    def count(self, model_class, conditions=None):
+    @staticmethod
+    def _iter_tsv(r, model_class, lightweight, validate):
+        if READINTO_DECODES:
+            # Reading the raw stream skips requests' chunk iteration, urllib3 still
+            # takes care of the transfer and content encodings
+            r.raw.decode_content = True
+            rows = read_tsv_rows(r.raw)
+        else:
+            rows = iter_tsv_rows(r.iter_content(chunk_size=FILE_CHUNK_SIZE))
+        field_names = next(rows)
+        field_types = next(rows)
+        model_class = model_class or ModelBase.create_ad_hoc_model(zip(field_names, field_types))
+        decode = model_class.row_decoder(field_names, lightweight, validate)
+        for values in rows:
+            yield decode(values)
+
+    @staticmethod
+    def _iter_rowbinary(r, model_class, lightweight, validate, server_timezone=None):
+        '''
+        Decodes a RowBinaryWithNamesAndTypes response. Columns are read by fields matching
+        the types in the header, so the model's own fields only convert the decoded values.
+        '''
+        reader = BinaryReader(r.iter_content(chunk_size=BINARY_CHUNK_SIZE))
+        model_class, columns = Database._read_rowbinary_header(reader, model_class, server_timezone)
+        names = [name for name, field in columns]
+        decode = model_class.row_decoder(names, lightweight, validate)
+        read_values = [field.read_binary for name, field in columns]
+        while not reader.at_eof():
+            yield decode([read_value(reader) for read_value in read_values])
+
+    def select_columns(self, query, model_class=None):
+        '''
+        Runs the query and returns an OrderedDict of NumPy arrays, one per column, decoded
+        in bulk from the Native format without creating per-row objects. Numbers keep their
+        native dtypes, dates become datetime64, enums are returned as their numeric values.
+        Columns that model_class declares are decoded by its fields. Nullable columns become
+        object arrays holding None, Decimal columns arrays of decimal.Decimal. Columns of
+        other types raise UnsupportedType.
+        '''
+        if numpy is None:
+            raise ImportError('select_columns requires numpy')
+        model_fields = dict(model_class._fields) if model_class else {}
+        query = self._substitute(query, model_class)
+        # LowCardinality columns are sent as plain values rather than as dictionaries
+        r = self.query(query + ' FORMAT Native', stream_response=True, settings=NATIVE_SETTINGS)
+        reader = BinaryReader(r.iter_content(chunk_size=BINARY_CHUNK_SIZE))
+        chunks = OrderedDict()
+        try:
+            while not reader.at_eof():
+                num_columns = reader.read_varint()
+                num_rows = reader.read_varint()
+                for _ in range(num_columns):
+                    name = reader.read_string()
+                    field = self._column_field(model_fields, name, reader.read_string())
+                    chunks.setdefault(name, []).append(field.read_column(reader, num_rows))
+        finally:
+            r.close()
+        if not chunks:
+            # Nothing was selected and no header block was sent, build empty columns
+            # for the columns of the query
+            empty = BinaryReader([])
+            return OrderedDict(
+                (name, self._column_field(model_fields, name, db_type).read_column(empty, 0))
+                for name, db_type in self._select_header(query)
+            )
+        return OrderedDict((name, numpy.concatenate(columns)) for name, columns in chunks.items())
+
+    def _select_header(self, query):
+        '''
+        Returns the (name, type) pairs of the columns of a query, selecting no rows.
+        '''
+        r = self.query(
+            'SELECT * FROM (%s) LIMIT 0 FORMAT TabSeparatedWithNamesAndTypes' % query
+        )
+        field_names, field_types = parse_tsv_rows(r.content)[:2]
+        return list(zip(field_names, field_types))
+
+    def select_arrow(self, query, model_class=None):
+        '''
+        Runs the query and returns a pyarrow Table read from the ArrowStream format,
+        without creating per-row Python objects.
+        '''
+        if pyarrow is None:
+            raise ImportError('select_arrow requires pyarrow')
+        query = self._substitute(query + ' FORMAT ArrowStream', model_class)
+        r = self.query(query, stream_response=True)
+        try:
+            r.raw.decode_content = True
+            return pyarrow.ipc.open_stream(r.raw).read_all()
+        finally:
+            r.close()
+
+    def export(self, query, path_or_fileobj, format='TabSeparatedWithNames', model_class=None,
+               decompress=True, use_pyarrow=False):
+        '''
+        Runs the query and writes the result in any ClickHouse output format to a file path
+        or a file object, copying the response body in chunks as it is received.
+        With response_compression, the body is decompressed on the fly unless decompress
+        is false, in which case the compressed body is written as it is.
+        With use_pyarrow, the result is requested as ArrowStream and its record batches are
+        written by pyarrow as an Arrow IPC file or a Parquet file (format must be Arrow or Parquet).
+        '''
+        if use_pyarrow:
+            if pyarrow is None:
+                raise ImportError('export with use_pyarrow requires pyarrow')
+            self._check_choice(format, ARROW_EXPORT_FORMATS)
+            query += ' FORMAT ArrowStream'
+        else:
+            query += ' FORMAT ' + format
+        r = self.query(self._substitute(query, model_class), stream_response=True)
+        try:
+            r.raw.decode_content = decompress or use_pyarrow
+            if use_pyarrow:
+                self._write_arrow(pyarrow.ipc.open_stream(r.raw), path_or_fileobj, format)
+            elif hasattr(path_or_fileobj, 'write'):
+                shutil.copyfileobj(r.raw, path_or_fileobj, FILE_CHUNK_SIZE)
+            else:
+                with open(path_or_fileobj, 'wb') as f:
+                    shutil.copyfileobj(r.raw, f, FILE_CHUNK_SIZE)
+        finally:
+            r.close()
+
+    @staticmethod
+    def _write_arrow(reader, path_or_fileobj, format):
+        if format == 'Parquet':
+            writer = pyarrow.parquet.ParquetWriter(path_or_fileobj, reader.schema)
+        else:
+            writer = pyarrow.ipc.new_file(path_or_fileobj, reader.schema)
+        with writer:
+            for batch in reader:
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+
+    def count(self, model_class, conditions=None, use_cache=True):
         query = 'SELECT count() FROM $table'
         if conditions:
             query += ' WHERE ' + conditions
         query = self._substitute(query, model_class)
-        r = self.query(query)
+        # Counts are small, so they are always coalesced with coalesce_reads
+        r = self._read_query(query, use_cache=use_cache, coalesce=True)
         count_value = int(r.text) if r.text else 0
         r.close()
         return count_value
 
-    def close(self):
-        self._requests_session.close()
+    def aggregate(self, model_class, group_by=(), sum=(), avg=(), uniq=(), conditions=None,
+                  sample=None, use_cache=True):
+        '''
+        Aggregates the table on the server and returns the results by columns: an OrderedDict
+        of lists, with the group_by expressions followed by count and sum_<field>, avg_<field>
+        and uniq_<field> for the given fields. With sample (a fraction such as 0.1, or a number
+        of rows), only a sample of the table is read, which requires a MergeTree engine with a
+        sampling_expr. Counts and sums are then scaled to the whole table, averages and
+        numbers of unique values are those of the sample.
+        '''
+        query = self._aggregate_sql(model_class, group_by, sum, avg, uniq, conditions, sample)
+        names = list(group_by) + ['count']
+        for prefix, field_names in (('sum_', sum), ('avg_', avg), ('uniq_', uniq)):
+            names.extend(prefix + name for name in field_names)
+        columns = OrderedDict((name, []) for name in names)
+        # The rows are typed by an ad hoc model, so $table is substituted here
+        query = self._substitute(query, model_class)
+        for row in self.select(query, lightweight=True, use_cache=use_cache):
+            for values, value in zip(columns.values(), row):
+                values.append(value)
+        return columns
 
-    def _load_hosts(self, new_hosts):
-        if len(new_hosts) == 0:
-            return
+    def paginate(self, model_class, order_by, page_num=1, page_size=100, conditions=None,
+                 use_cache=True):
+        '''
+        Returns a Page of model instances sorted by order_by. Pages are numbered from 1,
+        page_num=-1 returns the last one. The count and the LIMIT/OFFSET select are sent
+        concurrently. ClickHouse still reads and skips all the rows before the offset,
+        so deep pages of big tables are better read with seek_page.
+        '''
+        if page_num < 1 and page_num != -1:
+            raise ValueError('Invalid page number: %d' % page_num)
+        # The count runs in a thread of its own, as it may wait for hedged attempts
+        # on the client's executors
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            count_future = executor.submit(self.count, model_class, conditions, use_cache)
+            if page_num == -1:
+                # The number of the last page depends on the count
+                page_num = max(1, self._pages_total(count_future.result(), page_size))
+            query = 'SELECT * FROM $table'
+            if conditions:
+                query += ' WHERE ' + conditions
+            query += ' ORDER BY %s LIMIT %d, %d' % (order_by, (page_num - 1) * page_size, page_size)
+            objects = list(self.select(query, model_class, use_cache=use_cache))
+            number_of_objects = count_future.result()
+        return Page(
+            objects=objects,
+            number_of_objects=number_of_objects,
+            pages_total=self._pages_total(number_of_objects, page_size),
+            number=page_num,
+            page_size=page_size,
+        )
 
-        if len(self._host_manager.hosts_set()) != 0 and type(new_hosts) in {set, str, list}:
-            raise ValueError('Priority is not specified for new hosts')
+    @staticmethod
+    def _pages_total(number_of_objects, page_size):
+        return int(math.ceil(number_of_objects / float(page_size)))
 
-        if isinstance(new_hosts, list):
-            for priority, new_host in enumerate(new_hosts):
-                self._host_manager.add(priority, prepend_if_not('http://', new_host))
-        elif isinstance(new_hosts, set):
-            for new_host in new_hosts:
-                self._host_manager.add(1, prepend_if_not('http://', new_host))
-        elif isinstance(new_hosts, dict):
-            values = list(new_hosts.items())
-            if isinstance(values[0][0], int) and isinstance(values[0][1], list):
-                for priority, nested_new_hosts in values:
-                    for new_host in nested_new_hosts:
-                        self._host_manager.add(priority, prepend_if_not('http://', new_host))
-            elif isinstance(values[0][0], str) and isinstance(values[0][1], int):
-                for new_host, priority in values:
-                    self._host_manager.add(priority, prepend_if_not('http://', new_host))
+    def seek_page(self, model_class, after=None, page_size=100, conditions=None, use_cache=True, seen=1):
+        '''
+        Returns up to page_size model instances sorted by the key columns of the model's
+        MergeTree engine, then by its other fields, which follow after (the last instance or
+        row of the previous page, None for the first page). The rows are found through the
+        primary key, so reading a page costs the same however deep it is.
+        The key need not be unique, rows which share it are told apart by the other fields.
+        Rows equal to after in every field can not be, so seen is the number of them which
+        were returned already (after itself by default) and they are skipped.
+        '''
+        key_cols = self._get_key_cols(model_class)
+        order_cols = list(key_cols) + [name for name, field in model_class._fields if name not in key_cols]
+        where = ['(%s)' % conditions] if conditions else []
+        offset = 0
+        if after is not None:
+            fields = dict(model_class._fields)
+
+            def values(names):
+                return ', '.join(self._seek_literal(fields[name], getattr(after, name)) for name in names)
+
+            # The comparison of the key columns alone is the one the primary key can serve
+            where.append('(%s) >= (%s)' % (', '.join(key_cols), values(key_cols)))
+            where.append('(%s) >= (%s)' % (', '.join(order_cols), values(order_cols)))
+            offset = seen
+        query = 'SELECT * FROM $table'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY %s LIMIT %d, %d' % (', '.join(order_cols), offset, page_size)
+        return list(self.select(query, model_class, use_cache=use_cache))
+
+    def seek_pages(self, model_class, page_size=100, conditions=None, use_cache=True):
+        '''
+        Yields all the pages of seek_page, as lists of model instances.
+        '''
+        after = None
+        seen = 0
+        while True:
+            objects = self.seek_page(model_class, after, page_size, conditions, use_cache, seen)
+            if objects:
+                yield objects
+            if len(objects) < page_size:
+                return
+            # The next page skips the rows equal to the last one returned so far
+            last = self._row_values(model_class, objects[-1])
+            equal = 0
+            for instance in reversed(objects):
+                if self._row_values(model_class, instance) != last:
+                    break
+                equal += 1
+            if equal == len(objects) and after is not None and self._row_values(model_class, after) == last:
+                seen += equal
             else:
-                raise InconsistentConfig(
-                    'Dict object must be in format <int, list<str>> or <str, int>'
-                )
-        elif isinstance(new_hosts, str):
-            self._host_manager.add(1, prepend_if_not('http://', new_hosts))
-        else:
-            raise InconsistentConfig('Passed hosts must be a list, set, string or dict object')
+                seen = equal
+            after = objects[-1]
+
+    @staticmethod
+    def _seek_literal(field, value):
+        if isinstance(field, DateTimeField) and value.tzinfo is None:
+            # Naive values were read as the wall-clock time of the server, which parses
+            # them back the same way whatever the timezone of the client is
+            return "toDateTime('%s')" % value.strftime('%Y-%m-%d %H:%M:%S')
+        return field.to_db_string(value)
+
+    @staticmethod
+    def _row_values(model_class, instance):
+        return [getattr(instance, name) for name, field in model_class._fields]
+
+    @staticmethod
+    def _get_key_cols(model_class):
+        key_cols = getattr(model_class.engine, 'key_cols', None)
+        if not key_cols:
+            raise ValueError('%s has no MergeTree key columns' % model_class.__name__)
+        field_names = set(name for name, field in model_class._fields)
+        for name in key_cols:
+            if name not in field_names:
+                # Values of expressions can not be taken from the previous page
+                raise ValueError('Key column %s is not a field of %s' % (name, model_class.__name__))
+        return key_cols
+
+    def close(self):
+        if self._flusher:
+            self._flusher_stop.set()
+            self._flusher_wakeup.set()
+            self._flusher.join()
+            self.flush()
+        if self._senders:
+            self.flush()
+            for _ in self._senders:
+                self._send_queue.put(None)
+            for sender in self._senders:
+                sender.join()
+        self._executor.shutdown()
+        if self._hedge_executor is not None:
+            # Attempts which lost may still wait for slow hosts
+            self._hedge_executor.shutdown(wait=False)
+            self._kill_executor.shutdown(wait=False)
+        self._requests_session.close()
@@ -1,10 +1,19 @@
+import calendar
 import datetime
+import decimal
+import itertools
+import struct
 import time
 
 import pytz
 from six import binary_type, string_types, text_type
 
-from .utils import escape, parse_array
+from .utils import escape, parse_array, write_string, write_varint
+
+try:
+    import numpy
+except ImportError:
+    numpy = None  # columnar methods are unavailable
 
 
 class Field(object):
@@ -12,6 +21,7 @@ class Field(object):
     creation_counter = 0
     class_default = 0
     db_type = None
+    binary_format = None
 
     def __init__(self, default=None, alias=None):
         self.creation_counter = Field.creation_counter
@@ -47,6 +57,40 @@ class Field(object):
                 )
             )
 
+    def to_column(self, values):
+        '''
+        Converts a sequence of values into a NumPy array holding the values in the field's
+        binary representation, raising ValueError if they can't be converted.
+        Used only by fields with a binary_format.
+        '''
+        return numpy.asarray(values)
+
+    def validate_column(self, column):
+        '''
+        Called after to_column to validate all the values of the column at once.
+        Subclasses should override this.
+        '''
+        pass
+
+    def _numeric_column(self, values, kinds):
+        '''
+        Utility method to convert values into an array of one of the given NumPy dtype kinds.
+        '''
+        column = numpy.asarray(values)
+        if len(column) and column.dtype.kind not in kinds:
+            raise ValueError(
+                'Invalid column for %s - %s values' % (self.__class__.__name__, column.dtype)
+            )
+        return column
+
+    def _range_check_column(self, column, min_value, max_value):
+        '''
+        Utility method to check that all the column's values are between min_value and max_value.
+        '''
+        if len(column):
+            self._range_check(column.min().item(), min_value, max_value)
+            self._range_check(column.max().item(), min_value, max_value)
+
     def to_db_string(self, value, quote=True):
         '''
         Returns the field's value prepared for writing to the database.
@@ -54,6 +98,62 @@ class Field(object):
         '''
         return escape(value, quote)
 
+    def to_binary(self, value):
+        '''
+        Returns the field's value encoded for the RowBinary format. Fixed-width fields
+        only need to define binary_format, other fields should override this.
+        '''
+        if self.binary_format is None:
+            raise NotImplementedError(
+                '%s does not support binary encoding' % self.__class__.__name__
+            )
+        return self.binary_format.pack(value)
+
+    def read_binary(self, reader):
+        '''
+        Reads the field's value in the RowBinary format from a BinaryReader. The returned
+        value is not necessarily of the field's Pythonic type, but is accepted by to_python.
+        '''
+        if self.binary_format is None:
+            raise NotImplementedError(
+                '%s does not support binary decoding' % self.__class__.__name__
+            )
+        return reader.unpack(self.binary_format)
+
+    def read_column(self, reader, num_rows):
+        '''
+        Reads num_rows values of a column in the Native format from a BinaryReader and
+        returns them as a NumPy array. Fixed-width fields are read in bulk, other fields
+        fall back to read_binary and produce an object array.
+        '''
+        if self.binary_format is not None:
+            return self._read_fixed_column(reader, num_rows)
+        column = numpy.empty(num_rows, dtype=object)
+        for i in range(num_rows):
+            column[i] = self.read_binary(reader)
+        return column
+
+    def _read_fixed_column(self, reader, num_rows):
+        dtype = numpy.dtype(self.binary_format.format)
+        return numpy.frombuffer(reader.read(num_rows * dtype.itemsize), dtype)
+
+    def write_column(self, values):
+        '''
+        Returns a column of values encoded in the Native format. Fixed-width fields convert
+        and validate the whole column at once, other fields fall back to the per-value
+        to_python, validate and to_binary.
+        '''
+        if self.binary_format is not None:
+            column = self.to_column(values)
+            self.validate_column(column)
+            return column.astype(self.binary_format.format).tobytes()
+        parts = []
+        for value in values:
+            value = self.to_python(value)
+            self.validate(value)
+            parts.append(self.to_binary(value))
+        return b''.join(parts)
+
     def get_sql(self, with_default=True):
         '''
         Returns an SQL expression describing the field (e.g. for CREATE TABLE).
@@ -78,6 +178,12 @@ class StringField(Field):
             return value.decode('UTF-8')
         raise ValueError('Invalid value for %s: %r' % (self.__class__.__name__, value))
 
+    def to_binary(self, value):
+        return write_string(value)
+
+    def read_binary(self, reader):
+        return reader.read_string()
+
 
 class DateField(Field):
 
@@ -85,6 +191,7 @@ class DateField(Field):
     max_value = datetime.date(2038, 1, 19)
     class_default = min_value
     db_type = 'Date'
+    binary_format = struct.Struct('<H')
 
     def to_python(self, value):
         if isinstance(value, datetime.date):
@@ -103,11 +210,41 @@ class DateField(Field):
     def to_db_string(self, value, quote=True):
         return escape(value.isoformat(), quote)
 
+    def to_binary(self, value):
+        return self.binary_format.pack((value - DateField.min_value).days)
+
+    def read_binary(self, reader):
+        return DateField.min_value + datetime.timedelta(days=reader.unpack(self.binary_format))
+
+    def read_column(self, reader, num_rows):
+        return self._read_fixed_column(reader, num_rows).astype('datetime64[D]')
+
+    def to_column(self, values):
+        # Days since the epoch
+        try:
+            return numpy.asarray(values, dtype='datetime64[D]').astype('int64')
+        except (TypeError, ValueError):
+            raise ValueError('Invalid column for %s' % self.__class__.__name__)
+
+    def validate_column(self, column):
+        self._range_check_column(column, 0, (DateField.max_value - DateField.min_value).days)
+
 
 class DateTimeField(Field):
 
     class_default = datetime.datetime.fromtimestamp(0, pytz.utc)
     db_type = 'DateTime'
+    binary_format = struct.Struct('<I')
+
+    def __init__(self, default=None, alias=None, timezone=None):
+        '''
+        Naive values are in the given timezone (a name or a pytz timezone), or in
+        local time if it is None.
+        '''
+        super(DateTimeField, self).__init__(default, alias)
+        if isinstance(timezone, string_types):
+            timezone = pytz.timezone(timezone)
+        self.timezone = timezone
 
     def to_python(self, value):
         if isinstance(value, datetime.datetime):
@@ -120,8 +257,52 @@ class DateTimeField(Field):
             return datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
         raise ValueError('Invalid value for %s - %r' % (self.__class__.__name__, value))
 
+    def to_timestamp(self, value):
+        '''
+        Returns the Unix timestamp of a datetime. Aware values are converted from their
+        timezone, naive ones are taken in the field's timezone or as local time.
+        '''
+        if value.tzinfo is not None and value.utcoffset() is not None:
+            timestamp = calendar.timegm(value.utctimetuple())
+        elif self.timezone is not None:
+            timestamp = calendar.timegm(self.timezone.localize(value).utctimetuple())
+        else:
+            timestamp = int(time.mktime(value.timetuple()))
+        self._range_check(timestamp, 0, 2**32 - 1)
+        return timestamp
+
     def to_db_string(self, value, quote=True):
-        return escape(int(time.mktime(value.timetuple())), quote)
+        return escape(self.to_timestamp(value), quote)
+
+    def to_binary(self, value):
+        return self.binary_format.pack(self.to_timestamp(value))
+
+    def read_binary(self, reader):
+        timestamp = reader.unpack(self.binary_format)
+        if self.timezone is None:
+            return datetime.datetime.fromtimestamp(timestamp)
+        # The naive wall-clock time of the timezone, as text formats write it
+        return datetime.datetime.fromtimestamp(timestamp, self.timezone).replace(tzinfo=None)
+
+    def read_column(self, reader, num_rows):
+        return self._read_fixed_column(reader, num_rows).astype('datetime64[s]')
+
+    def to_column(self, values):
+        # Seconds since the epoch. datetime64 values are taken as UTC, other values are
+        # converted one by one as by insert(), so naive datetimes are in local time
+        column = numpy.asarray(values)
+        if column.dtype.kind == 'M':
+            return column.astype('datetime64[s]').astype('int64')
+        if column.dtype.kind in 'iu':
+            return column.astype('int64')
+        try:
+            return numpy.array([self.to_timestamp(self.to_python(value)) for value in column.tolist()],
+                               dtype='int64')
+        except (TypeError, ValueError):
+            raise ValueError('Invalid column for %s' % self.__class__.__name__)
+
+    def validate_column(self, column):
+        self._range_check_column(column, 0, 2**32 - 1)
 
 
 class BaseIntField(Field):
@@ -135,12 +316,19 @@ class BaseIntField(Field):
     def validate(self, value):
         self._range_check(value, self.min_value, self.max_value)
 
+    def to_column(self, values):
+        return self._numeric_column(values, 'biu')
+
+    def validate_column(self, column):
+        self._range_check_column(column, self.min_value, self.max_value)
+
 
 class UInt8Field(BaseIntField):
 
     min_value = 0
     max_value = 2**8 - 1
     db_type = 'UInt8'
+    binary_format = struct.Struct('<B')
 
 
 class UInt16Field(BaseIntField):
@@ -148,6 +336,7 @@ class UInt16Field(BaseIntField):
     min_value = 0
     max_value = 2**16 - 1
     db_type = 'UInt16'
+    binary_format = struct.Struct('<H')
 
 
 class UInt32Field(BaseIntField):
@@ -155,6 +344,7 @@ class UInt32Field(BaseIntField):
     min_value = 0
     max_value = 2**32 - 1
     db_type = 'UInt32'
+    binary_format = struct.Struct('<I')
 
 
 class UInt64Field(BaseIntField):
@@ -162,6 +352,7 @@ class UInt64Field(BaseIntField):
     min_value = 0
     max_value = 2**64 - 1
     db_type = 'UInt64'
+    binary_format = struct.Struct('<Q')
 
 
 class Int8Field(BaseIntField):
@@ -169,6 +360,7 @@ class Int8Field(BaseIntField):
     min_value = -2**7
     max_value = 2**7 - 1
     db_type = 'Int8'
+    binary_format = struct.Struct('<b')
 
 
 class Int16Field(BaseIntField):
@@ -176,6 +368,7 @@ class Int16Field(BaseIntField):
     min_value = -2**15
     max_value = 2**15 - 1
     db_type = 'Int16'
+    binary_format = struct.Struct('<h')
 
 
 class Int32Field(BaseIntField):
@@ -183,6 +376,7 @@ class Int32Field(BaseIntField):
     min_value = -2**31
     max_value = 2**31 - 1
     db_type = 'Int32'
+    binary_format = struct.Struct('<i')
 
 
 class Int64Field(BaseIntField):
@@ -190,6 +384,7 @@ class Int64Field(BaseIntField):
     min_value = -2**63
     max_value = 2**63 - 1
     db_type = 'Int64'
+    binary_format = struct.Struct('<q')
 
 
 class BaseFloatField(Field):
@@ -200,15 +395,31 @@ class BaseFloatField(Field):
         except:
             raise ValueError('Invalid value for %s - %r' % (self.__class__.__name__, value))
 
+    def to_column(self, values):
+        return self._numeric_column(values, 'biuf')
+
 
 class Float32Field(BaseFloatField):
 
     db_type = 'Float32'
+    binary_format = struct.Struct('<f')
+
+    def read_binary(self, reader):
+        raw = reader.read(4)
+        value = self.binary_format.unpack(raw)[0]
+        # Find the shortest representation that maps to the same float32, as ClickHouse
+        # does in text formats, so that e.g. 1.72 is not read back as 1.7200000286
+        for precision in (6, 7, 8):
+            rounded = float('%.*g' % (precision, value))
+            if self.binary_format.pack(rounded) == raw:
+                return rounded
+        return value
 
 
 class Float64Field(BaseFloatField):
 
     db_type = 'Float64'
+    binary_format = struct.Struct('<d')
 
 
 class BaseEnumField(Field):
@@ -236,6 +447,20 @@ class BaseEnumField(Field):
     def to_db_string(self, value, quote=True):
         return escape(value.name, quote)
 
+    def to_binary(self, value):
+        return self.binary_format.pack(value.value)
+
+    def to_column(self, values):
+        # Numeric columns are taken as enum values, anything else is converted one by one
+        column = numpy.asarray(values)
+        if column.dtype.kind in 'iu':
+            return column
+        return numpy.array([self.to_python(value).value for value in values], dtype='int64')
+
+    def validate_column(self, column):
+        if not numpy.isin(column, [item.value for item in self.enum_cls]).all():
+            raise ValueError('Invalid value for %s in column' % self.enum_cls.__name__)
+
     def get_sql(self, with_default=True):
         values = ['%s = %d' % (escape(item.name), item.value) for item in self.enum_cls]
         sql = '%s(%s)' % (self.db_type, ' ,'.join(values))
@@ -267,11 +492,13 @@ class BaseEnumField(Field):
 class Enum8Field(BaseEnumField):
 
     db_type = 'Enum8'
+    binary_format = struct.Struct('<b')
 
 
 class Enum16Field(BaseEnumField):
 
     db_type = 'Enum16'
+    binary_format = struct.Struct('<h')
 
 
 class ArrayField(Field):
@@ -299,10 +526,155 @@ class ArrayField(Field):
         array = [self.inner_field.to_db_string(v, quote=True) for v in value]
         return '[' + ', '.join(array) + ']'
 
+    def to_binary(self, value):
+        parts = [write_varint(len(value))]
+        parts.extend(self.inner_field.to_binary(v) for v in value)
+        return b''.join(parts)
+
+    def read_binary(self, reader):
+        return [self.inner_field.read_binary(reader) for _ in range(reader.read_varint())]
+
+    def read_column(self, reader, num_rows):
+        # Native arrays are stored as cumulative offsets followed by the flattened values
+        offsets = numpy.frombuffer(reader.read(num_rows * 8), '<u8')
+        values = self.inner_field.read_column(reader, int(offsets[-1]) if num_rows else 0)
+        column = numpy.empty(num_rows, dtype=object)
+        start = 0
+        for i, end in enumerate(offsets):
+            column[i] = values[start:end]
+            start = end
+        return column
+
+    def write_column(self, values):
+        values = list(values)
+        for value in values:
+            if not isinstance(value, (list, tuple, numpy.ndarray)):
+                raise ValueError('ArrayField expects list or tuple, not %s' % type(value))
+        offsets = numpy.cumsum([len(value) for value in values], dtype='<u8')
+        if len(values) and all(isinstance(value, numpy.ndarray) for value in values):
+            flat = numpy.concatenate(values)
+        else:
+            flat = list(itertools.chain.from_iterable(values))
+        return offsets.tobytes() + self.inner_field.write_column(flat)
+
     def get_sql(self, with_default=True):
         return 'Array(%s)' % self.inner_field.get_sql(with_default=False)
 
 
+class NullableField(Field):
+    '''
+    A Nullable(...) column: None, or a value of the inner field.
+    '''
+
+    class_default = None
+
+    def __init__(self, inner_field, default=None, alias=None):
+        self.inner_field = inner_field
+        super(NullableField, self).__init__(default, alias)
+
+    def to_python(self, value):
+        # NULL is \N in text formats
+        if value is None or value == '\\N':
+            return None
+        return self.inner_field.to_python(value)
+
+    def validate(self, value):
+        if value is not None:
+            self.inner_field.validate(value)
+
+    def to_db_string(self, value, quote=True):
+        if value is None:
+            return 'NULL' if quote else '\\N'
+        return self.inner_field.to_db_string(value, quote)
+
+    def to_binary(self, value):
+        if value is None:
+            return b'\x01'
+        return b'\x00' + self.inner_field.to_binary(value)
+
+    def read_binary(self, reader):
+        if reader.read(1) != b'\x00':
+            return None
+        return self.inner_field.read_binary(reader)
+
+    def read_column(self, reader, num_rows):
+        # Native nullable columns are stored as a null map followed by all the values
+        null_map = numpy.frombuffer(reader.read(num_rows), 'u1').astype(bool)
+        column = self.inner_field.read_column(reader, num_rows).astype(object)
+        column[null_map] = None
+        return column
+
+    def write_column(self, values):
+        values = list(values)
+        null_map = bytes(bytearray(1 if value is None else 0 for value in values))
+        default = self.inner_field.default
+        return null_map + self.inner_field.write_column(
+            [default if value is None else value for value in values]
+        )
+
+    def get_sql(self, with_default=True):
+        return 'Nullable(%s)' % self.inner_field.get_sql(with_default=False)
+
+
+class DecimalField(Field):
+    '''
+    A Decimal(precision, scale) column, stored as an integer of 32, 64 or 128 bits
+    depending on the precision. Values are decimal.Decimal objects.
+    '''
+
+    class_default = decimal.Decimal(0)
+    int128_format = struct.Struct('<Qq')
+
+    def __init__(self, precision, scale, default=None, alias=None):
+        if not 1 <= precision <= 38 or not 0 <= scale <= precision:
+            raise ValueError('Invalid precision or scale for Decimal(%d, %d)' % (precision, scale))
+        self.precision = precision
+        self.scale = scale
+        if precision <= 9:
+            self.int_format = struct.Struct('<i')
+        elif precision <= 18:
+            self.int_format = struct.Struct('<q')
+        else:
+            self.int_format = None
+        super(DecimalField, self).__init__(default, alias)
+
+    def to_python(self, value):
+        if isinstance(value, decimal.Decimal):
+            return value
+        try:
+            if isinstance(value, float):
+                return decimal.Decimal(repr(value))
+            return decimal.Decimal(value)
+        except (TypeError, ValueError, decimal.InvalidOperation):
+            raise ValueError('Invalid value for %s - %r' % (self.__class__.__name__, value))
+
+    def validate(self, value):
+        limit = decimal.Decimal(10) ** (self.precision - self.scale)
+        self._range_check(value, -limit + 1, limit - 1)
+
+    def to_binary(self, value):
+        number = int(value.scaleb(self.scale).to_integral_value(decimal.ROUND_HALF_EVEN))
+        if self.int_format is not None:
+            return self.int_format.pack(number)
+        return self.int128_format.pack(number & (2**64 - 1), number >> 64)
+
+    def read_binary(self, reader):
+        if self.int_format is not None:
+            number = reader.unpack(self.int_format)
+        else:
+            low, high = self.int128_format.unpack(reader.read(16))
+            number = (high << 64) | low
+        return decimal.Decimal(number).scaleb(-self.scale)
+
+    def get_sql(self, with_default=True):
+        sql = 'Decimal(%d, %d)' % (self.precision, self.scale)
+        if with_default:
+            sql += ' DEFAULT %s' % self.to_db_string(self.default)
+        if self.alias:
+            sql += ' ALIAS %s' % self.to_db_string(self.alias)
+        return sql
+
+
 class FixedStringField(StringField):
     db_type = 'FixedString'
 
@@ -310,6 +682,31 @@ class FixedStringField(StringField):
         super(FixedStringField, self).__init__(default, alias)
         self.width = width
 
+    def to_binary(self, value):
+        value = value.encode('UTF-8')
+        if len(value) > self.width:
+            raise ValueError(
+                'Value for %s is too long - %d bytes do not fit into %d' % (
+                    self.__class__.__name__,
+                    len(value),
+                    self.width
+                )
+            )
+        return value + b'\0' * (self.width - len(value))
+
+    def read_binary(self, reader):
+        return reader.read(self.width).decode('UTF-8')
+
+    def read_column(self, reader, num_rows):
+        return numpy.frombuffer(reader.read(num_rows * self.width), 'S%d' % self.width)
+
+    def write_column(self, values):
+        column = numpy.asarray(values)
+        if column.dtype.kind == 'S' and column.dtype.itemsize <= self.width:
+            # Byte strings are padded with zeros by NumPy itself
+            return column.astype('S%d' % self.width).tobytes()
+        return super(FixedStringField, self).write_column(values)
+
     def get_sql(self, with_default=True):
         '''
         Returns an SQL expression describing the field (e.g. for CREATE TABLE).
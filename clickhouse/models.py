@@ -1,9 +1,150 @@
-from six import with_metaclass
+from collections import OrderedDict
+from operator import itemgetter
+
+from six import get_unbound_function, with_metaclass
 
 from .fields import Field
+from .query import QuerySet
 from .utils import parse_tsv
 
 
+def _is_overridden(cls, name, base):
+    return get_unbound_function(getattr(cls, name)) is not get_unbound_function(getattr(base, name))
+
+
+def _compile(source, name, namespace):
+    exec(compile(source, '<%s>' % name, 'exec'), namespace)
+    return namespace[name]
+
+
+def _tuple_source(items):
+    return '(%s)' % ''.join(item + ', ' for item in items)
+
+
+def _make_encoders(cls):
+    '''
+    Generates the to_tsv and to_rowbinary functions of a model class, which read
+    every field straight from the instance's __dict__.
+    '''
+    namespace = {}
+    tsv_values = []
+    binary_values = []
+    for i, (name, field) in enumerate(cls._fields):
+        namespace['to_db_string_%d' % i] = field.to_db_string
+        namespace['to_binary_%d' % i] = field.to_binary
+        tsv_values.append('to_db_string_%d(d[%r], False)' % (i, name))
+        binary_values.append('to_binary_%d(d[%r])' % (i, name))
+    source = '\n'.join([
+        'def to_tsv(self):',
+        '    d = self.__dict__',
+        '    return \'\\t\'.join(%s)' % _tuple_source(tsv_values),
+        '',
+        'def to_rowbinary(self):',
+        '    d = self.__dict__',
+        '    return b\'\'.join(%s)' % _tuple_source(binary_values),
+    ])
+    return _compile(source, 'to_tsv', namespace), namespace['to_rowbinary']
+
+
+def _make_decoder(cls, field_names, validate):
+    '''
+    Generates a function creating an instance of the model class from a list of values
+    given in the order of field_names. Fields that are not listed get their defaults.
+    Without validate, values are only converted to their Pythonic types.
+    '''
+    fields = dict(cls._fields)
+    for name in field_names:
+        if name not in fields:
+            raise AttributeError('%s does not have a field called %s' % (cls.__name__, name))
+    if _is_overridden(cls, '__init__', Model) or _is_overridden(cls, '__setattr__', Model):
+        # Custom constructors must still be called
+        return lambda values: cls(**dict(zip(field_names, values)))
+    positions = dict((name, i) for i, name in enumerate(field_names))
+    namespace = {'new': object.__new__, 'cls': cls}
+    lines = [
+        'def decode(values):',
+        '    instance = new(cls)',
+        '    d = instance.__dict__',
+    ]
+    for i, (name, field) in enumerate(cls._fields):
+        namespace['field_%d' % i] = field
+        namespace['to_python_%d' % i] = field.to_python
+        namespace['validate_%d' % i] = field.validate
+        if name in positions:
+            lines.append('    value = to_python_%d(values[%d])' % (i, positions[name]))
+        else:
+            lines.append('    value = to_python_%d(field_%d.default)' % (i, i))
+        if validate and _is_overridden(type(field), 'validate', Field):
+            lines.append('    validate_%d(value)' % i)
+        lines.append('    d[%r] = value' % name)
+    lines.append('    return instance')
+    return _compile('\n'.join(lines), 'decode', namespace)
+
+
+def _make_row_class(cls):
+    '''
+    Generates the Row subclass of a model class, with a read-only property per field.
+    '''
+    attrs = {
+        '__slots__': (),
+        '_fields': tuple(name for name, field in cls._fields),
+        '_model': cls,
+    }
+    for i, (name, field) in enumerate(cls._fields):
+        attrs[name] = property(itemgetter(i))
+    return type(cls.__name__ + 'Row', (Row,), attrs)
+
+
+def _make_row_decoder(cls, field_names):
+    '''
+    Generates a function creating a row of the model class from a list of values given
+    in the order of field_names. Values are converted but not validated.
+    '''
+    fields = dict(cls._fields)
+    for name in field_names:
+        if name not in fields:
+            raise AttributeError('%s does not have a field called %s' % (cls.__name__, name))
+    positions = dict((name, i) for i, name in enumerate(field_names))
+    namespace = {'new': tuple.__new__, 'row_class': cls.row_class()}
+    values = []
+    for i, (name, field) in enumerate(cls._fields):
+        namespace['field_%d' % i] = field
+        namespace['to_python_%d' % i] = field.to_python
+        if name in positions:
+            values.append('to_python_%d(values[%d])' % (i, positions[name]))
+        else:
+            values.append('to_python_%d(field_%d.default)' % (i, i))
+    source = 'def decode(values):\n    return new(row_class, %s)' % _tuple_source(values)
+    return _compile(source, 'decode', namespace)
+
+
+class Row(tuple):
+    '''
+    A lightweight, read-only representation of a model instance: a tuple of the field
+    values in the order of the model's fields, which are also available as attributes.
+    Rows have no __dict__, so they take several times less memory than model instances.
+    '''
+
+    __slots__ = ()
+    _fields = ()
+    _model = None
+
+    def __repr__(self):
+        return '%s(%s)' % (
+            self.__class__.__name__,
+            ', '.join('%s=%r' % item for item in zip(self._fields, self)),
+        )
+
+    def _asdict(self):
+        return OrderedDict(zip(self._fields, self))
+
+    def to_model(self):
+        '''
+        Returns a full (validated) model instance with the row's values.
+        '''
+        return self._model(**self._asdict())
+
+
 class ModelBase(type):
     '''
     A metaclass for ORM models. It adds the _fields list to model classes.
@@ -22,6 +163,10 @@ class ModelBase(type):
         fields = base_fields + [item for item in attrs.items() if isinstance(item[1], Field)]
         fields.sort(key=lambda item: item[1].creation_counter)
         setattr(new_cls, '_fields', fields)
+        # Row codecs specialized for this class, decoders are added per field_names ordering
+        new_cls._to_tsv, new_cls._to_rowbinary = _make_encoders(new_cls)
+        new_cls._row_decoders = {}
+        new_cls._row_class = None
         return new_cls
 
     @classmethod
@@ -51,6 +196,26 @@ class ModelBase(type):
         if db_type.startswith('Array'):
             inner_field = cls.create_ad_hoc_field(db_type[6:-1])
             return orm_fields.ArrayField(inner_field)
+        # Fixed strings
+        if db_type.startswith('FixedString'):
+            return orm_fields.FixedStringField(int(db_type[12:-1]))
+        # Wrappers: LowCardinality does not change the values, Nullable adds None
+        if db_type.startswith('LowCardinality('):
+            return cls.create_ad_hoc_field(db_type[15:-1])
+        if db_type.startswith('Nullable('):
+            return orm_fields.NullableField(cls.create_ad_hoc_field(db_type[9:-1]))
+        # Date and time with a timezone
+        if db_type.startswith('DateTime('):
+            return orm_fields.DateTimeField(timezone=db_type[9:-1].strip("'"))
+        # Decimals, as Decimal(P, S) or Decimal32/64/128(S)
+        if db_type.startswith('Decimal'):
+            name, args = db_type[:-1].split('(', 1)
+            args = [int(arg) for arg in args.split(',')]
+            if name == 'Decimal':
+                return orm_fields.DecimalField(*args)
+            precisions = {'Decimal32': 9, 'Decimal64': 18, 'Decimal128': 38}
+            if name in precisions:
+                return orm_fields.DecimalField(precisions[name], args[0])
         # Simple fields
         name = db_type + 'Field'
         if not hasattr(orm_fields, name):
@@ -113,6 +278,13 @@ class Model(with_metaclass(ModelBase)):
         '''
         return cls._table_name or cls.__name__.lower()
 
+    @classmethod
+    def objects(cls, database):
+        '''
+        Returns a lazy QuerySet of the model's table in the database.
+        '''
+        return QuerySet(cls, database)
+
     @classmethod
     def create_table_sql(cls, db_name):
         '''
@@ -144,21 +316,54 @@ class Model(with_metaclass(ModelBase)):
         If omitted, it is assumed to be the names of all fields in the model,
         in order of definition.
         '''
-        from six import next
-        field_names = field_names or [name for name, field in cls._fields]
-        values = iter(parse_tsv(line))
-        kwargs = {}
-        for name in field_names:
-            kwargs[name] = next(values)
-        return cls(**kwargs)
+        return cls.from_values(parse_tsv(line), field_names)
+
+    @classmethod
+    def from_values(cls, values, field_names=None):
+        '''
+        Create a model instance from a list of column values, such as a row
+        returned by parse_tsv_rows. The field_names list works as in from_tsv.
+        '''
+        return cls.row_decoder(field_names)(values)
+
+    @classmethod
+    def row_decoder(cls, field_names=None, lightweight=False, validate=True):
+        '''
+        Returns a function that creates an instance from a list of column values
+        ordered as field_names (all fields by default). The function is generated
+        once per ordering and cached on the class, so it can be called for every row.
+        Without validate, values are converted to their Pythonic types but not validated,
+        which is safe for values typed by the database. With lightweight, the function
+        creates rows of row_class() instead, which are never validated.
+        '''
+        key = (tuple(field_names) if field_names else None, lightweight, validate or lightweight)
+        decoder = cls._row_decoders.get(key)
+        if decoder is None:
+            field_names = key[0] or [name for name, field in cls._fields]
+            if lightweight:
+                decoder = _make_row_decoder(cls, field_names)
+            else:
+                decoder = _make_decoder(cls, field_names, validate)
+            cls._row_decoders[key] = decoder
+        return decoder
+
+    @classmethod
+    def row_class(cls):
+        '''
+        Returns the Row subclass for this model, generated on first use.
+        '''
+        if cls._row_class is None:
+            cls._row_class = _make_row_class(cls)
+        return cls._row_class
 
     def to_tsv(self):
         '''
         Returns the instance's column values as a tab-separated line. A newline is not included.
         '''
-        parts = []
-        for name, field in self._fields:
-            value = field.to_db_string(getattr(self, name), quote=False)
-            parts.append(value)
-        tsv = '\t'.join(parts)
-        return tsv
+        return self._to_tsv()
+
+    def to_rowbinary(self):
+        '''
+        Returns the instance's column values encoded in the RowBinary format.
+        '''
+        return self._to_rowbinary()
@@ -0,0 +1,182 @@
+'''
+Lazy querysets, see Model.objects(database).
+'''
+
+# Lookups of filter keyword arguments (field__lookup=value) and their SQL templates
+LOOKUPS = {
+    'eq': '%s = %s',
+    'ne': '%s != %s',
+    'gt': '%s > %s',
+    'gte': '%s >= %s',
+    'lt': '%s < %s',
+    'lte': '%s <= %s',
+    'in': '%s IN (%s)',
+    'not_in': '%s NOT IN (%s)',
+    'contains': 'position(%s, %s) > 0',
+    'startswith': 'startsWith(%s, %s)',
+    'endswith': 'endsWith(%s, %s)',
+}
+
+
+class QuerySet(object):
+    '''
+    A query over the table of a model which is sent only when the queryset is iterated.
+    Methods return new querysets, so a queryset can be refined without changing it:
+
+        people = Person.objects(db).filter(birthday__gte='2000-01-01').only('first_name')
+        for person in people.order_by('-height').limit(10):
+            ...
+    '''
+
+    def __init__(self, model_class, database):
+        self._model_class = model_class
+        self._database = database
+        self._fields = dict(model_class._fields)
+        self._conditions = []
+        self._columns = None
+        self._order_by = []
+        self._limit = None
+        self._offset = 0
+        self._lightweight = False
+
+    def _clone(self, **attrs):
+        queryset = QuerySet.__new__(QuerySet)
+        queryset.__dict__.update(self.__dict__)
+        queryset._conditions = list(self._conditions)
+        queryset.__dict__.update(attrs)
+        return queryset
+
+    def _get_field(self, name):
+        field = self._fields.get(name)
+        if field is None:
+            raise AttributeError(
+                '%s does not have a field called %s' % (self._model_class.__name__, name)
+            )
+        return field
+
+    def _compile_lookup(self, key, value):
+        name, _, lookup = key.partition('__')
+        field = self._get_field(name)
+        template = LOOKUPS.get(lookup or 'eq')
+        if template is None:
+            raise ValueError('Invalid lookup: %s' % key)
+        if lookup in ('in', 'not_in'):
+            if not value:
+                raise ValueError('Empty list of values for %s' % key)
+            sql_value = ', '.join(field.to_db_string(field.to_python(v)) for v in value)
+        elif lookup in ('contains', 'startswith', 'endswith'):
+            sql_value = field.to_db_string(value)
+        else:
+            sql_value = field.to_db_string(field.to_python(value))
+        return template % (name, sql_value)
+
+    def filter(self, *conditions, **lookups):
+        '''
+        Returns a queryset with more conditions, combined with AND. Conditions are SQL
+        expressions, lookups are field=value or field__lookup=value pairs, see LOOKUPS.
+        Values are converted by the fields and quoted.
+        '''
+        compiled = ['(%s)' % condition for condition in conditions]
+        compiled.extend(self._compile_lookup(key, value) for key, value in sorted(lookups.items()))
+        return self._clone(_conditions=self._conditions + compiled)
+
+    def exclude(self, *conditions, **lookups):
+        '''
+        Returns a queryset without the rows matching all the given conditions and lookups.
+        '''
+        if not conditions and not lookups:
+            raise ValueError('exclude() needs at least one condition')
+        condition = ' AND '.join(self.filter(*conditions, **lookups)._conditions[len(self._conditions):])
+        return self._clone(_conditions=self._conditions + ['NOT (%s)' % condition])
+
+    def only(self, *field_names):
+        '''
+        Returns a queryset selecting only the given fields, the others get their defaults.
+        '''
+        for name in field_names:
+            self._get_field(name)
+        return self._clone(_columns=list(field_names))
+
+    def order_by(self, *field_names):
+        '''
+        Returns a queryset sorted by the given fields, descending for names prefixed with '-'.
+        '''
+        order_by = []
+        for name in field_names:
+            if name.startswith('-'):
+                self._get_field(name[1:])
+                order_by.append(name[1:] + ' DESC')
+            else:
+                self._get_field(name)
+                order_by.append(name)
+        return self._clone(_order_by=order_by)
+
+    def limit(self, limit, offset=0):
+        return self._clone(_limit=limit, _offset=offset)
+
+    def lightweight(self):
+        '''
+        Returns a queryset yielding read-only rows instead of model instances,
+        see Database.select.
+        '''
+        return self._clone(_lightweight=True)
+
+    def conditions_as_sql(self):
+        return ' AND '.join(self._conditions)
+
+    def as_sql(self):
+        '''
+        Returns the SQL query of the queryset, with $table not substituted.
+        '''
+        columns = ', '.join(self._columns) if self._columns else '*'
+        sql = 'SELECT %s FROM $table' % columns
+        if self._conditions:
+            sql += ' WHERE ' + self.conditions_as_sql()
+        if self._order_by:
+            sql += ' ORDER BY ' + ', '.join(self._order_by)
+        if self._limit is not None:
+            sql += ' LIMIT %d, %d' % (self._offset, self._limit)
+        return sql
+
+    def __iter__(self):
+        return self._database.select(self.as_sql(), self._model_class, lightweight=self._lightweight)
+
+    def __getitem__(self, index):
+        '''
+        Slicing sets LIMIT and OFFSET, e.g. queryset[20:30] is queryset.limit(10, 20).
+        Slices of a limited queryset stay within its limit.
+        '''
+        if not isinstance(index, slice):
+            raise TypeError('QuerySet indices must be slices, not %s' % type(index).__name__)
+        start, stop = index.start or 0, index.stop
+        if index.step is not None or stop is None or start < 0 or stop < 0:
+            raise ValueError('Only slices with a non-negative start and stop are supported')
+        if self._limit is not None:
+            start, stop = min(start, self._limit), min(stop, self._limit)
+        return self.limit(max(0, stop - start), self._offset + start)
+
+    def count(self):
+        '''
+        Returns the number of matching rows, counted by the database.
+        '''
+        count = self._database.count(self._model_class, self.conditions_as_sql() or None)
+        if self._limit is not None:
+            count = max(0, min(count - self._offset, self._limit))
+        return count
+
+    def aggregate(self, group_by=(), sum=(), avg=(), uniq=(), sample=None):
+        '''
+        Aggregates the matching rows on the server, see Database.aggregate.
+        '''
+        return self._database.aggregate(
+            self._model_class,
+            group_by,
+            sum=sum,
+            avg=avg,
+            uniq=uniq,
+            conditions=self.conditions_as_sql() or None,
+            sample=sample,
+        )
+
+    def __repr__(self):
+        return '<QuerySet %s: %s>' % (self._model_class.__name__, self.as_sql())
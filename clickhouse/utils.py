@@ -1,7 +1,7 @@
 import codecs
 import re
 
-from six import PY3, binary_type, string_types, text_type
+from six import binary_type, string_types, text_type
 
 SPECIAL_CHARS = {
     "\b": "\\b",
@@ -18,6 +18,7 @@ SPECIAL_CHARS = {
 def prepend_if_not(prep, str):
     if not str.startswith(prep):
         return prep + str
+    return str
 
 
 def derive_relative_topology(topology, your_dc):
@@ -49,16 +50,241 @@ def escape(value, quote=True):
     return text_type(value)
 
 
+def write_varint(value):
+    '''
+    Encodes a non-negative integer as an unsigned LEB128 varint, which is how
+    ClickHouse binary formats store the lengths of strings and arrays.
+    '''
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def write_string(value):
+    '''
+    Encodes a string as its varint length followed by the UTF-8 bytes.
+    '''
+    if isinstance(value, text_type):
+        value = value.encode('UTF-8')
+    return write_varint(len(value)) + value
+
+
+class BinaryReader(object):
+    '''
+    Reads values of ClickHouse binary formats from an iterable of byte chunks
+    (e.g. a streamed HTTP response). Values may straddle chunk boundaries.
+    '''
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+        self._pos = 0
+        self._offset = 0
+
+    def _fill(self, size):
+        '''
+        Makes sure that at least size bytes are buffered. Returns False if the stream
+        ended before that.
+        '''
+        available = len(self._buffer) - self._pos
+        if available >= size:
+            return True
+        parts = [self._buffer[self._pos:]]
+        for chunk in self._chunks:
+            parts.append(chunk)
+            available += len(chunk)
+            if available >= size:
+                break
+        self._buffer = b''.join(parts)
+        self._offset += self._pos
+        self._pos = 0
+        return available >= size
+
+    def read(self, size):
+        if not self._fill(size):
+            raise EOFError('Unexpected end of binary stream')
+        value = self._buffer[self._pos:self._pos + size]
+        self._pos += size
+        return value
+
+    def unpack(self, binary_format):
+        '''
+        Reads a single value described by a struct.Struct object.
+        '''
+        if not self._fill(binary_format.size):
+            raise EOFError('Unexpected end of binary stream')
+        value = binary_format.unpack_from(self._buffer, self._pos)[0]
+        self._pos += binary_format.size
+        return value
+
+    def read_varint(self):
+        result = 0
+        shift = 0
+        while True:
+            byte = ord(self.read(1))
+            result |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return result
+            shift += 7
+
+    def read_string(self):
+        return self.read(self.read_varint()).decode('UTF-8')
+
+    def at_eof(self):
+        return not self._fill(1)
+
+    def tell(self):
+        '''
+        Returns the number of bytes read from the start of the stream.
+        '''
+        return self._offset + self._pos
+
+
+class BinaryFeedReader(BinaryReader):
+    '''
+    A BinaryReader over chunks passed to feed, for streams which can only be read
+    asynchronously. Reading past the data fed so far raises EOFError; rollback then
+    returns to the position of the last commit, so that the value can be read again
+    once more data is fed. The data is kept in a single bytearray, the bytes before
+    the commit are dropped as new chunks arrive.
+    '''
+
+    def __init__(self):
+        super(BinaryFeedReader, self).__init__(())
+        self._buffer = bytearray()
+        self._committed = 0
+
+    def feed(self, chunk):
+        del self._buffer[:self._committed]
+        self._offset += self._committed
+        self._pos -= self._committed
+        self._committed = 0
+        self._buffer += chunk
+
+    def _fill(self, size):
+        return len(self._buffer) - self._pos >= size
+
+    def commit(self):
+        self._committed = self._pos
+
+    def rollback(self):
+        self._pos = self._committed
+
+
 def unescape(value):
+    if isinstance(value, text_type):
+        value = value.encode('utf-8')
     return codecs.escape_decode(value)[0].decode('utf-8')
 
 
 def parse_tsv(line):
-    if PY3 and isinstance(line, binary_type):
-        line = line.decode()
-    if line[-1] == '\n':
+    '''
+    Parses a single tab-separated line (bytes or text, with or without the newline)
+    into a list of values. Only the values containing a backslash need unescaping.
+    '''
+    if isinstance(line, binary_type):
+        line = line.decode('utf-8')
+    if line.endswith('\n'):
         line = line[:-1]
-    return [unescape(value) for value in line.split('\t')]
+    if '\\' not in line:
+        return line.split('\t')
+    return [unescape(value) if '\\' in value else value for value in line.split('\t')]
+
+
+def parse_tsv_rows(data):
+    '''
+    Parses a chunk of complete tab-separated lines (bytes or a memoryview) into a list
+    of rows. The whole chunk is decoded and split at once, and when it has no backslash
+    at all no value is looked at individually.
+    '''
+    text = codecs.utf_8_decode(data, 'strict', True)[0]
+    lines = text.split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    if '\\' not in text:
+        return [line.split('\t') for line in lines]
+    return [
+        [unescape(value) if '\\' in value else value for value in line.split('\t')]
+        if '\\' in line else line.split('\t')
+        for line in lines
+    ]
+
+
+class TSVReader(object):
+    '''
+    Collects chunks of a tab-separated stream, which may split lines anywhere,
+    and parses the complete lines of every chunk with parse_tsv_rows.
+    '''
+
+    def __init__(self):
+        self._pending = []
+
+    def feed(self, chunk):
+        '''
+        Returns the rows completed by the chunk.
+        '''
+        end = chunk.rfind(b'\n')
+        if end < 0:
+            self._pending.append(chunk)
+            return []
+        self._pending.append(chunk[:end + 1])
+        data = b''.join(self._pending)
+        self._pending = [chunk[end + 1:]]
+        return parse_tsv_rows(data)
+
+    def close(self):
+        '''
+        Returns the row of a last line that has no trailing newline, if any.
+        '''
+        data = b''.join(self._pending)
+        self._pending = []
+        return parse_tsv_rows(data) if data else []
+
+
+def read_tsv_rows(stream, buffer_size=1024 * 1024):
+    '''
+    Parses the rows of a tab-separated stream (any object with readinto). The stream is
+    read into a single reusable buffer and the complete lines in it are parsed straight
+    from a memoryview, the incomplete last line is moved to the start of the buffer.
+    The buffer doubles when a line does not fit in it.
+    '''
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    filled = 0
+    while True:
+        if filled == len(buf):
+            buf = buf + bytearray(len(buf))
+            view = memoryview(buf)
+        size = stream.readinto(view[filled:])
+        if not size:
+            break
+        filled += size
+        # Earlier data has no newline, otherwise it would have been parsed already
+        end = buf.rfind(b'\n', filled - size, filled) + 1
+        if not end:
+            continue
+        for row in parse_tsv_rows(view[:end]):
+            yield row
+        view[:filled - end] = view[end:filled]
+        filled -= end
+    if filled:
+        for row in parse_tsv_rows(view[:filled]):
+            yield row
+
+
+def iter_tsv_rows(chunks):
+    '''
+    Parses the rows of a tab-separated stream given as an iterable of byte chunks.
+    '''
+    reader = TSVReader()
+    for chunk in chunks:
+        for row in reader.feed(chunk):
+            yield row
+    for row in reader.close():
+        yield row
 
 
 def parse_array(array_string):
@@ -28,7 +28,7 @@ if __name__ == '__main__':
             "Topic :: Database"
         ],
 
-        packages=find_packages(exclude=('tests', 'tests.*')),
+        packages=find_packages(exclude=('tests', 'tests.*', 'benchmarks', 'benchmarks.*')),
         install_requires=[
             'pytz',
             'requests',
@@ -36,5 +36,13 @@ if __name__ == '__main__':
             'six',
             'enum34',
             'izihawa-commons >= 0.0.10',
-        ]
+            'futures; python_version < "3"',
+        ],
+        extras_require={
+            'numpy': ['numpy'],
+            'async': ['aiohttp'],
+            'zstd': ['zstandard'],
+            'lz4': ['lz4'],
+            'arrow': ['pyarrow'],
+        },
     )
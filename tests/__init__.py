@@ -1,5 +1,18 @@
+import sys
+
 from .test_array_fields import *
+from .test_balancing import *
+from .test_buffer import *
+from .test_cache import *
+from .test_columns import *
 from .test_database import *
 from .test_enum_fields import *
 from .test_inheritance import *
-from .test_models import *
\ No newline at end of file
+from .test_models import *
+from .test_querysets import *
+from .test_rowbinary import *
+from .test_tsv import *
+
+if sys.version_info >= (3, 6):
+    # The asyncio client and its tests need Python 3.6+
+    from .test_aio import *
\ No newline at end of file
@@ -0,0 +1,66 @@
+import asyncio
+import unittest
+
+from .test_database import Person, data
+
+try:
+    from clickhouse.aio import AsyncDatabase
+except ImportError:
+    AsyncDatabase = None
+
+
+@unittest.skipIf(AsyncDatabase is None, 'aiohttp is not installed')
+class AsyncDatabaseTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.database = self.run_async(AsyncDatabase.connect('localhost:8123', 'test-db'))
+        self.run_async(self.database.create_table(Person))
+
+    def tearDown(self):
+        self.run_async(self.database.drop_table(Person))
+        self.run_async(self.database.drop_database())
+        self.run_async(self.database.close())
+        self.loop.close()
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def _collect(self, *args, **kwargs):
+        async def collect():
+            return [instance async for instance in self.database.select(*args, **kwargs)]
+        return self.run_async(collect())
+
+    def test_insert_and_count(self):
+        self.run_async(self.database.insert(Person(**entry) for entry in data))
+        self.assertEqual(self.run_async(self.database.count(Person)), len(data))
+        counts = self.run_async(asyncio.gather(*[
+            self.database.count(Person, "first_name = 'Courtney'") for _ in range(20)
+        ]))
+        self.assertEqual(counts, [2] * 20)
+
+    def test_select(self):
+        self.run_async(self.database.insert(Person(**entry) for entry in data))
+        query = "SELECT * FROM $table WHERE first_name = 'Whitney' ORDER BY last_name"
+        for select_format in ('TabSeparatedWithNamesAndTypes', 'RowBinaryWithNamesAndTypes'):
+            results = self._collect(query, Person, select_format=select_format)
+            self.assertEqual([person.last_name for person in results], ['Durham', 'Scott'])
+            self.assertEqual(results[0].height, 1.72)
+
+    def test_buffered_insert(self):
+        self.database._buffer_size = 1000
+        self.run_async(self.database.insert(Person(**entry) for entry in data))
+        self.assertEqual(self.run_async(self.database.count(Person)), 0)
+        self.run_async(self.database.flush())
+        self.assertEqual(self.run_async(self.database.count(Person)), len(data))
+
+    def test_buffered_insert__formats(self):
+        self.database._buffer_size = 1000
+        half = len(data) // 2
+        self.run_async(self.database.insert(Person(**entry) for entry in data[:half]))
+        self.run_async(self.database.insert(
+            (Person(**entry) for entry in data[half:]), insert_format='RowBinary'
+        ))
+        self.assertEqual(self.run_async(self.database.count(Person)), 0)
+        self.run_async(self.database.flush())
+        self.assertEqual(self.run_async(self.database.count(Person)), len(data))
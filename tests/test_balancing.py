@@ -0,0 +1,64 @@
+import itertools
+import unittest
+
+from clickhouse.balancing import (EWMAHostSelector, HostSelector,
+                                  LeastOutstandingHostSelector)
+
+
+class CyclingHostManager(object):
+    '''
+    Returns the given hosts in turn instead of randomly.
+    '''
+
+    def __init__(self, hosts):
+        self._hosts = itertools.cycle(hosts)
+
+    def get(self):
+        return next(self._hosts)
+
+
+class HostSelectorTestCase(unittest.TestCase):
+
+    def test_metrics(self):
+        selector = HostSelector(CyclingHostManager(['a']))
+        host = selector.select()
+        started = selector.start(host)
+        self.assertEqual(selector.stats()[host]['outstanding'], 1)
+        selector.finish(host, started - 0.1, failed=False)
+        selector.finish(host, selector.start(host) - 0.2, failed=False)
+        selector.finish(host, selector.start(host), failed=True)
+        stats = selector.stats()[host]
+        self.assertEqual((stats['requests'], stats['errors'], stats['outstanding']), (3, 1, 0))
+        # 100 ms, then moved towards 200 ms by alpha; the failure is not measured
+        self.assertAlmostEqual(stats['latency_ms'], 120, delta=5)
+
+    def test_ewma(self):
+        selector = EWMAHostSelector(CyclingHostManager(['slow', 'fast']))
+        selector.finish('slow', selector.start('slow') - 0.5, failed=False)
+        selector.finish('fast', selector.start('fast') - 0.01, failed=False)
+        self.assertEqual([selector.select() for _ in range(3)], ['fast'] * 3)
+        # Hosts without measurements are tried first
+        selector = EWMAHostSelector(CyclingHostManager(['fast', 'new']))
+        selector.finish('fast', selector.start('fast') - 0.01, failed=False)
+        self.assertEqual(selector.select(), 'new')
+        # Hosts whose requests have all failed are picked last
+        selector = EWMAHostSelector(CyclingHostManager(['broken', 'slow']))
+        selector.finish('broken', selector.start('broken'), failed=True)
+        selector.finish('slow', selector.start('slow') - 0.5, failed=False)
+        self.assertEqual([selector.select() for _ in range(3)], ['slow'] * 3)
+
+    def test_least_outstanding(self):
+        selector = LeastOutstandingHostSelector(CyclingHostManager(['a', 'b']))
+        selector.start('a')
+        self.assertEqual(selector.select(), 'b')
+        selector.start('b')
+        selector.start('b')
+        self.assertEqual(selector.select(), 'a')
+
+    def test_latency_percentile(self):
+        selector = HostSelector(CyclingHostManager(['a']))
+        self.assertIsNone(selector.latency_percentile(90))
+        for latency in range(1, 101):
+            selector.finish('a', selector.start('a') - latency / 1000.0, failed=False)
+        self.assertAlmostEqual(selector.latency_percentile(90), 91, delta=2)
+        self.assertAlmostEqual(selector.latency_percentile(50), 51, delta=2)
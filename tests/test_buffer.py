@@ -0,0 +1,108 @@
+import time
+import unittest
+
+from clickhouse.database import Database, FlushPolicy, InsertBuffer
+
+from .test_database import NamedModel, Person, data
+
+
+class InsertBufferTestCase(unittest.TestCase):
+
+    def test_append_and_release(self):
+        insert_buffer = InsertBuffer(Person, 'TabSeparated')
+        self.assertTrue(insert_buffer.append(b'a\n', 1))
+        self.assertFalse(insert_buffer.append(b'b\nc\n', 2))
+        self.assertEqual((insert_buffer.rows, insert_buffer.size), (3, 6))
+        self.assertEqual(insert_buffer.release().read(), b'a\nb\nc\n')
+        self.assertEqual((insert_buffer.rows, insert_buffer.size), (0, 0))
+        self.assertIsNone(insert_buffer.release())
+
+    def test_take_and_restore(self):
+        insert_buffer = InsertBuffer(Person, 'TabSeparated')
+        insert_buffer.append(b'a\nb\n', 2)
+        data, rows, first_row_time = insert_buffer.take()
+        self.assertEqual(rows, 2)
+        insert_buffer.append(b'c\n', 1)
+        insert_buffer.restore(data, rows, first_row_time)
+        self.assertEqual((insert_buffer.rows, insert_buffer.size), (3, 6))
+        self.assertEqual(insert_buffer.first_row_time, first_row_time)
+        self.assertEqual(insert_buffer.release().read(), b'a\nb\nc\n')
+
+    def test_time_left(self):
+        insert_buffer = InsertBuffer(Person, 'TabSeparated')
+        policy = FlushPolicy(max_rows=3, max_bytes=100, max_latency_ms=1000)
+        self.assertIsNone(insert_buffer.time_left(policy, time.time()))
+        insert_buffer.append(b'a\n', 1)
+        now = insert_buffer.first_row_time
+        self.assertAlmostEqual(insert_buffer.time_left(policy, now + 0.25), 0.75)
+        self.assertIsNone(insert_buffer.time_left(FlushPolicy(max_rows=3), now))
+        insert_buffer.append(b'b\nc\n', 2)
+        self.assertEqual(insert_buffer.time_left(policy, now), 0)
+        insert_buffer.release()
+        insert_buffer.append(b'x' * 100, 1)
+        self.assertEqual(insert_buffer.time_left(policy, now), 0)
+
+
+class BackgroundFlushTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database(
+            'localhost:8123',
+            'test-db',
+            flush_policy=FlushPolicy(max_latency_ms=200),
+            flush_policies={Person: FlushPolicy(max_rows=50, max_latency_ms=60000)},
+        )
+        self.database.create_table(Person)
+
+    def tearDown(self):
+        self.database.drop_database()
+        self.database.close()
+
+    def _sample_data(self, count):
+        return [Person(**entry) for entry in data[:count]]
+
+    def test_flush_on_rows(self):
+        self.database.insert(self._sample_data(10))
+        time.sleep(0.5)
+        self.assertEqual(self.database.count(Person), 0)
+        self.database.insert(self._sample_data(40))
+        time.sleep(0.5)
+        self.assertEqual(self.database.count(Person), 50)
+
+    def test_flush_on_latency(self):
+        self.database._flush_policies = {}
+        self.database.insert(self._sample_data(10))
+        time.sleep(1)
+        self.assertEqual(self.database.count(Person), 10)
+
+
+class DefaultFlushPolicyTestCase(unittest.TestCase):
+
+    def test_buffer_size(self):
+        # Models without a policy are flushed by the flusher after buffer_size rows
+        database = Database('localhost:8123', 'test-db', buffer_size=5,
+                            flush_policies={Person: FlushPolicy(max_rows=1000)})
+        self.assertEqual(database._get_flush_policy(Person), FlushPolicy(max_rows=1000))
+        self.assertEqual(database._get_flush_policy(NamedModel), FlushPolicy(max_rows=6))
+        database.close()
+
+
+class SenderWorkersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.database = Database('localhost:8123', 'test-db', sender_workers=2, send_queue_size=4)
+        self.database.create_table(Person)
+
+    def tearDown(self):
+        self.database.drop_database()
+        self.database.close()
+
+    def test_insert_and_flush(self):
+        for entry in data:
+            self.database.insert([Person(**entry)])
+        self.database.flush()
+        self.assertEqual(self.database.count(Person), len(data))
+        stats = self.database.send_queue_stats()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['enqueued'], len(data))
+        self.assertEqual(stats['sent'], len(data))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+import io
+import threading
+import time
+import unittest
+
+from clickhouse.cache import CachedResponse, RecordingResponse, ResultCache, SingleFlight
+from urllib3.response import HTTPResponse
+
+
+class ResultCacheTestCase(unittest.TestCase):
+
+    def test_get_and_put(self):
+        cache = ResultCache(ttl=60, max_bytes=100)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', b'1\n')
+        self.assertEqual(cache.get('a'), b'1\n')
+        self.assertEqual(cache.stats(), dict(hits=1, misses=1, evictions=0, entries=1, bytes=2))
+
+    def test_ttl(self):
+        cache = ResultCache(ttl=0.05, max_bytes=100)
+        cache.put('a', b'1\n')
+        time.sleep(0.1)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['bytes'], 0)
+
+    def test_lru_eviction(self):
+        cache = ResultCache(ttl=60, max_bytes=10)
+        cache.put('a', b'aaaa')
+        cache.put('b', b'bbbb')
+        # 'a' becomes the most recently used, so 'b' is evicted
+        cache.get('a')
+        cache.put('c', b'cccc')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), b'aaaa')
+        self.assertEqual(cache.get('c'), b'cccc')
+        self.assertEqual(cache.stats()['evictions'], 1)
+        # Bodies larger than the whole cache are not stored
+        cache.put('d', b'd' * 11)
+        self.assertIsNone(cache.get('d'))
+
+    def test_cached_response(self):
+        r = CachedResponse(u'a\tб\n'.encode('utf-8'))
+        self.assertEqual(r.text, u'a\tб\n')
+        self.assertEqual(b''.join(r.iter_content(chunk_size=2)), r.content)
+        self.assertEqual(r.raw.read(), r.content)
+
+
+class RecordingResponseTestCase(unittest.TestCase):
+
+    def _response(self, content, max_bytes):
+        recorded = []
+        response = StreamedResponse(content)
+        return RecordingResponse(response, max_bytes, recorded.append), recorded
+
+    def test_recorded_when_read(self):
+        r, recorded = self._response(b'1\n2\n3\n', 100)
+        buf = bytearray(4)
+        self.assertEqual(r.raw.readinto(buf), 4)
+        self.assertEqual(recorded, [])
+        self.assertEqual(b''.join(r.iter_content(chunk_size=3)), b'3\n')
+        self.assertEqual(recorded, [b'1\n2\n3\n'])
+
+    def test_not_recorded_when_too_big(self):
+        r, recorded = self._response(b'x' * 1000, 100)
+        self.assertEqual(len(r.content), 1000)
+        self.assertEqual(recorded, [])
+
+
+class StreamedResponse(object):
+
+    def __init__(self, content):
+        self.raw = HTTPResponse(body=io.BytesIO(content), preload_content=False)
+
+    def close(self):
+        self.raw.close()
+
+
+class SingleFlightTestCase(unittest.TestCase):
+
+    def test_followers_share_the_result(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return b'1\n'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(single_flight.do('q', fetch)))
+        leader.start()
+        started.wait()
+        followers = [
+            threading.Thread(target=lambda: results.append(single_flight.do('q', fetch)))
+            for _ in range(3)
+        ]
+        for follower in followers:
+            follower.start()
+        while single_flight.stats()['followers'] < 3:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [b'1\n'] * 4)
+        self.assertEqual(single_flight.stats(), dict(leaders=1, followers=3))
+        # The key is released after the call
+        self.assertEqual(single_flight.do('q', lambda: b'2\n'), b'2\n')
+
+    def test_exception_is_shared(self):
+        single_flight = SingleFlight()
+
+        def fail():
+            raise ValueError('failed')
+
+        self.assertRaises(ValueError, single_flight.do, 'q', fail)
+        self.assertEqual(single_flight.do('q', lambda: b'1\n'), b'1\n')
+
+    def test_interruption_is_shared(self):
+        single_flight = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        errors = []
+
+        def interrupted():
+            started.set()
+            release.wait()
+            raise KeyboardInterrupt()
+
+        def call():
+            try:
+                single_flight.do('q', interrupted)
+            except KeyboardInterrupt as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=call) for _ in range(2)]
+        threads[0].start()
+        started.wait()
+        threads[1].start()
+        while single_flight.stats()['followers'] < 1:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 2)
@@ -0,0 +1,122 @@
+import datetime
+import decimal
+import unittest
+
+from clickhouse.database import Database, UnsupportedType
+from clickhouse.fields import (ArrayField, DateField, DateTimeField, DecimalField, Enum8Field,
+                               FixedStringField, Float64Field, Int16Field, NullableField,
+                               StringField, UInt8Field)
+from clickhouse.utils import BinaryReader
+
+try:
+    Enum  # exists in Python 3.4+
+except NameError:
+    from enum import Enum  # use the enum34 library instead
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class ReadColumnTestCase(unittest.TestCase):
+
+    def _read(self, field, data, num_rows):
+        reader = BinaryReader([data])
+        column = field.read_column(reader, num_rows)
+        self.assertTrue(reader.at_eof())
+        return column
+
+    def test_numbers(self):
+        column = self._read(Int16Field(), b'\x01\x00\xff\xff', 2)
+        self.assertEqual(column.dtype, numpy.int16)
+        self.assertEqual(column.tolist(), [1, -1])
+        column = self._read(Float64Field(), b'\x00\x00\x00\x00\x00\x00\xf0?', 1)
+        self.assertEqual(column.tolist(), [1.0])
+
+    def test_dates(self):
+        column = self._read(DateField(), b'\x00\x00\x01\x00', 2)
+        self.assertEqual(column.tolist(), [numpy.datetime64('1970-01-01'), numpy.datetime64('1970-01-02')])
+        column = self._read(DateTimeField(), b'\x3c\x00\x00\x00', 1)
+        self.assertEqual(column[0], numpy.datetime64('1970-01-01T00:01:00'))
+
+    def test_strings(self):
+        column = self._read(StringField(), b'\x01a\x00\x02bc', 3)
+        self.assertEqual(column.dtype, object)
+        self.assertEqual(column.tolist(), [u'a', u'', u'bc'])
+        column = self._read(FixedStringField(2), b'ab\x00\x00', 2)
+        self.assertEqual(column.tolist(), [b'ab', b''])
+
+    def test_arrays(self):
+        data = b'\x02\x00\x00\x00\x00\x00\x00\x00' + b'\x02\x00\x00\x00\x00\x00\x00\x00'
+        data += b'\x03\x00\x04\x00'
+        column = self._read(ArrayField(Int16Field()), data, 2)
+        self.assertEqual([list(value) for value in column], [[3, 4], []])
+        self.assertEqual(len(self._read(ArrayField(Int16Field()), b'', 0)), 0)
+
+    def test_wrapped_types(self):
+        # Native nullable columns are a null map followed by all the values
+        column = self._read(NullableField(Int16Field()), b'\x00\x01' + b'\x03\x00\x00\x00', 2)
+        self.assertEqual(column.tolist(), [3, None])
+        column = self._read(DecimalField(9, 2), b'\x7d\x00\x00\x00', 1)
+        self.assertEqual(column.tolist(), [decimal.Decimal('1.25')])
+        field = Database._column_field({}, 'name', 'LowCardinality(Nullable(String))')
+        self.assertEqual(self._read(field, b'\x01\x00' + b'\x00\x01a', 2).tolist(), [None, u'a'])
+        with self.assertRaises(UnsupportedType):
+            Database._column_field({}, 'point', 'Tuple(Float64, Float64)')
+
+
+@unittest.skipIf(numpy is None, 'numpy is not installed')
+class WriteColumnTestCase(unittest.TestCase):
+
+    def _roundtrip(self, field, values):
+        return field.read_column(BinaryReader([field.write_column(values)]), len(values))
+
+    def test_numbers(self):
+        self.assertEqual(UInt8Field().write_column(numpy.array([1, 255])), b'\x01\xff')
+        self.assertEqual(self._roundtrip(Float64Field(), [1, 2.5]).tolist(), [1.0, 2.5])
+        self.assertEqual(UInt8Field().write_column([]), b'')
+
+    def test_range_errors(self):
+        for field, values in ((UInt8Field(), [0, 256]), (Int16Field(), numpy.array([-2**15 - 1]))):
+            with self.assertRaises(ValueError):
+                field.write_column(values)
+        with self.assertRaises(ValueError):
+            UInt8Field().write_column([1.5])
+        with self.assertRaises(ValueError):
+            DateField().write_column(['1969-12-31'])
+
+    def test_dates(self):
+        values = [datetime.date(2016, 8, 30), '2017-01-01']
+        column = self._roundtrip(DateField(), values)
+        self.assertEqual(column.astype(object).tolist(), [datetime.date(2016, 8, 30), datetime.date(2017, 1, 1)])
+        values = numpy.array(['2017-01-01T10:00:00'], dtype='datetime64[s]')
+        self.assertEqual(self._roundtrip(DateTimeField(), values).tolist(), values.tolist())
+        # Datetimes are encoded as by insert()
+        field = DateTimeField()
+        value = datetime.datetime(2017, 1, 1, 10)
+        self.assertEqual(field.write_column([value]), field.to_binary(value))
+
+    def test_strings(self):
+        self.assertEqual(self._roundtrip(StringField(), [u'a', b'bc']).tolist(), [u'a', u'bc'])
+        self.assertEqual(self._roundtrip(FixedStringField(3), numpy.array([b'ab', b'c'])).tolist(), [b'ab', b'c'])
+        self.assertEqual(self._roundtrip(FixedStringField(3), [u'ab']).tolist(), [b'ab'])
+
+    def test_enums(self):
+        field = Enum8Field(Shape)
+        self.assertEqual(field.write_column([Shape.circle, 'square', 1]), b'\x02\x01\x01')
+        with self.assertRaises(ValueError):
+            field.write_column(numpy.array([3]))
+
+    def test_arrays(self):
+        field = ArrayField(Int16Field())
+        column = self._roundtrip(field, [[1, 2], [], (3,)])
+        self.assertEqual([value.tolist() for value in column], [[1, 2], [], [3]])
+        column = self._roundtrip(field, [numpy.array([5], dtype='int16')])
+        self.assertEqual([value.tolist() for value in column], [[5]])
+        with self.assertRaises(ValueError):
+            field.write_column([[1], [2**20]])
+
+
+Shape = Enum('Shape', u'square circle')
@@ -1,11 +1,20 @@
 # -*- coding: utf-8 -*-
 
+import datetime
+import decimal
+import io
 import logging
+import threading
+import time
 import unittest
+from collections import OrderedDict
 
-from clickhouse.database import Database
+from six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from six.moves.socketserver import ThreadingMixIn
+
+from clickhouse.database import KILL_CONCURRENCY, Database, InconsistentConfig, pyarrow
 from clickhouse.engines import MergeTree
-from clickhouse.fields import DateField, Float32Field, StringField
+from clickhouse.fields import DateField, DateTimeField, Float32Field, StringField, UInt64Field
 from clickhouse.models import Model
 
 logging.getLogger("requests").setLevel(logging.WARNING)
@@ -40,6 +49,82 @@ class DatabaseTestCase(unittest.TestCase):
     def test_insert__empty(self):
         self._insert_and_check([], 0)
 
+    def test_insert__rowbinary(self):
+        self.database.insert(self._sample_data(), insert_format='RowBinary')
+        self.assertEqual(len(data), self.database.count(Person))
+        query = "SELECT * FROM `test-db`.person WHERE first_name = 'Whitney' ORDER BY last_name"
+        results = list(self.database.select(query, Person))
+        self.assertEqual(results[0].birthday.isoformat(), '1977-09-15')
+        self.assertAlmostEqual(results[0].height, 1.72, places=5)
+
+    def test_insert_columns(self):
+        columns = {
+            'first_name': [entry['first_name'] for entry in data],
+            'birthday': [entry['birthday'] for entry in data],
+            'height': [float(entry['height']) for entry in data],
+        }
+        self.database.insert_columns(Person, columns)
+        self.assertEqual(len(data), self.database.count(Person))
+        self.assertEqual(self.database.count(Person, "first_name = 'Courtney'"), 2)
+        with self.assertRaises(ValueError):
+            self.database.insert_columns(Person, {'birthday': ['1900-01-01']})
+
+    def test_insert_file(self):
+        lines = [instance.to_tsv() for instance in self._sample_data()]
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        self.database.insert_file(Person, io.BytesIO(body))
+        self.assertEqual(len(data), self.database.count(Person))
+        # Parts of about 100 bytes, each sent by its own query
+        self.database.insert_file(Person, io.BytesIO(body), part_size=100)
+        self.assertEqual(2 * len(data), self.database.count(Person))
+        with self.assertRaises(InconsistentConfig):
+            self.database.insert_file(Person, io.BytesIO(body), 'Native', part_size=100)
+        with self.assertRaises(InconsistentConfig):
+            # Quoted CSV values may contain newlines
+            self.database.insert_file(Person, io.BytesIO(body), 'CSV', part_size=100)
+
+    def test_insert_file__cooldown(self):
+        lines = [instance.to_tsv() for instance in self._sample_data()]
+        body = ('\n'.join(lines) + '\n').encode('utf-8')
+        database = Database({'localhost:8123': 1, '127.0.0.1:8123': 1}, 'test-db')
+        try:
+            # Parts are not assigned to a host which is cooling down
+            database._cool_down_host('http://127.0.0.1:8123', 60)
+            self.assertEqual(database._top_priority_hosts(), ['http://localhost:8123'])
+            database.insert_file(Person, io.BytesIO(body), part_size=100)
+            self.assertEqual(len(data), database.count(Person))
+            self.assertNotIn('http://127.0.0.1:8123', database.host_stats())
+        finally:
+            database.close()
+
+    def test_connection_stats(self):
+        database = Database('localhost:8123', 'test-db', prewarm_connections=2)
+        try:
+            for _ in range(5):
+                database.count(Person)
+            stats = database.connection_stats()['http://localhost:8123']
+            self.assertEqual(stats['opened'], 2)
+            self.assertGreaterEqual(stats['hits'], 5)
+            self.assertEqual(stats['discarded'], 0)
+        finally:
+            database.close()
+
+    def test_compression(self):
+        for codec in ('gzip', 'zstd', 'lz4'):
+            try:
+                database = Database(
+                    'localhost:8123',
+                    'test-db',
+                    request_compression=codec,
+                    response_compression='gzip',
+                )
+            except InconsistentConfig:
+                continue  # the codec's library is not installed
+            database.insert(self._sample_data())
+            self.assertEqual(len(list(database.select('SELECT * FROM $table', Person))), database.count(Person))
+            database.close()
+        self.assertEqual(self.database.count(Person) % len(data), 0)
+
     def test_count(self):
         self.database.insert(self._sample_data())
         self.assertEqual(self.database.count(Person), 100)
@@ -47,6 +132,52 @@ class DatabaseTestCase(unittest.TestCase):
         self.assertEqual(self.database.count(Person, "birthday > '2000-01-01'"), 22)
         self.assertEqual(self.database.count(Person, "birthday < '1970-03-01'"), 0)
 
+    def test_count__hedged(self):
+        self.database.insert(self._sample_data())
+        # The same server is listed under two names, so reads not answered at once
+        # are also sent to the other one
+        database = Database({'localhost:8123': 1, '127.0.0.1:8123': 1}, 'test-db', hedge_delay=0)
+        try:
+            for _ in range(5):
+                self.assertEqual(database.count(Person), 100)
+            query = "SELECT * FROM $table WHERE first_name = 'Whitney'"
+            self.assertEqual(len(list(database.select(query, Person))), 2)
+        finally:
+            database.close()
+
+    def test_count__hedged_threads(self):
+        self.database.insert(self._sample_data())
+        threads = threading.active_count()
+        database = Database({'localhost:8123': 1, '127.0.0.1:8123': 1}, 'test-db', hedge_delay=0)
+        # Attempts and KILLs reuse the threads of bounded pools instead of starting new ones
+        limit = threads + database._hedge_concurrency + KILL_CONCURRENCY
+        try:
+            for _ in range(500):
+                self.assertEqual(database.count(Person), 100)
+                self.assertLessEqual(threading.active_count(), limit)
+        finally:
+            database.close()
+
+    def test_count__hedged_slow_host(self):
+        self.database.insert(self._sample_data())
+        slow_host = SlowHost(delay=2)
+        database = Database({'localhost:8123': 1, slow_host.url: 1}, 'test-db', hedge_delay=0.1)
+        try:
+            database._host_selector.select = lambda: slow_host.url
+            started = time.time()
+            self.assertEqual(database.count(Person), 100)
+            self.assertLess(time.time() - started, 1)
+            self.assertEqual(database.host_stats()['http://localhost:8123']['requests'], 1)
+            # The slow query is killed from a thread of its own
+            for _ in range(50):
+                if slow_host.kills:
+                    break
+                time.sleep(0.02)
+            self.assertEqual(len(slow_host.kills), 1)
+        finally:
+            database.close()
+            slow_host.close()
+
     def test_select(self):
         self._insert_and_check(self._sample_data(), len(data))
         query = "SELECT * FROM `test-db`.person WHERE first_name = 'Whitney' ORDER BY last_name"
@@ -57,6 +188,71 @@ class DatabaseTestCase(unittest.TestCase):
         self.assertEqual(results[1].last_name, 'Scott')
         self.assertEqual(results[1].height, 1.70)
 
+    def test_select__rowbinary(self):
+        self._insert_and_check(self._sample_data(), len(data))
+        query = "SELECT * FROM `test-db`.person WHERE first_name = 'Whitney' ORDER BY last_name"
+        for model_cls in (Person, None):
+            results = list(self.database.select(query, model_cls, select_format='RowBinaryWithNamesAndTypes'))
+            self.assertEqual(len(results), 2)
+            self.assertEqual(results[0].last_name, 'Durham')
+            self.assertEqual(results[0].height, 1.72)
+            self.assertEqual(results[1].last_name, 'Scott')
+            self.assertEqual(results[1].height, 1.70)
+
+    def test_select__lightweight(self):
+        self._insert_and_check(self._sample_data(), len(data))
+        query = "SELECT * FROM `test-db`.person WHERE first_name = 'Whitney' ORDER BY last_name"
+        for select_format in ('TabSeparatedWithNamesAndTypes', 'RowBinaryWithNamesAndTypes'):
+            results = list(self.database.select(query, Person, select_format, lightweight=True))
+            self.assertEqual(len(results), 2)
+            self.assertIsInstance(results[0], Person.row_class())
+            self.assertEqual(results[0].last_name, 'Durham')
+            self.assertEqual(results[1].to_model().height, 1.70)
+
+    def test_select_columns(self):
+        self._insert_and_check(self._sample_data(), len(data))
+        query = "SELECT first_name, birthday, height FROM $table ORDER BY first_name, last_name"
+        columns = self.database.select_columns(query, Person)
+        self.assertEqual(list(columns), ['first_name', 'birthday', 'height'])
+        self.assertEqual(len(columns['height']), len(data))
+        self.assertEqual(columns['first_name'][0], 'Abdul')
+        self.assertEqual(str(columns['birthday'][0]), '1970-12-02')
+
+    def test_select_columns__wrapped_types(self):
+        self._insert_and_check(self._sample_data(), len(data))
+        query = ("SELECT toLowCardinality(first_name) AS first_name, toNullable(height) AS height, "
+                 "toDecimal32(height, 2) AS price, toDateTime(birthday, 'UTC') AS created "
+                 "FROM $table ORDER BY first_name, last_name LIMIT 1")
+        columns = self.database.select_columns(query, Person)
+        self.assertEqual(columns['first_name'].tolist(), ['Abdul'])
+        self.assertEqual(str(columns['created'][0]), '1970-12-02T00:00:00')
+        self.assertIsInstance(columns['price'][0], decimal.Decimal)
+        self.assertAlmostEqual(columns['height'][0], float(columns['price'][0]), delta=0.01)
+
+    def test_select_columns__empty(self):
+        query = "SELECT first_name, height FROM $table"
+        columns = self.database.select_columns(query, Person)
+        self.assertEqual(list(columns), ['first_name', 'height'])
+        self.assertEqual(len(columns['height']), 0)
+
+    def test_export(self):
+        self._insert_and_check(self._sample_data(), len(data))
+        query = "SELECT first_name, height FROM $table WHERE first_name = 'Whitney' ORDER BY last_name"
+        f = io.BytesIO()
+        self.database.export(query, f, 'TabSeparatedWithNames', Person)
+        self.assertEqual(f.getvalue(), b'first_name\theight\nWhitney\t1.72\nWhitney\t1.7\n')
+
+    @unittest.skipIf(pyarrow is None, 'requires pyarrow')
+    def test_export__pyarrow(self):
+        self._insert_and_check(self._sample_data(), len(data))
+        query = "SELECT first_name, height FROM $table ORDER BY first_name, last_name"
+        table = self.database.select_arrow(query, Person)
+        self.assertEqual(table.num_rows, len(data))
+        f = io.BytesIO()
+        self.database.export(query, f, 'Parquet', Person, use_pyarrow=True)
+        f.seek(0)
+        self.assertTrue(pyarrow.parquet.read_table(f).equals(table))
+
     def test_select_partial_fields(self):
         self._insert_and_check(self._sample_data(), len(data))
         query = "SELECT first_name, last_name FROM `test-db`.person " \
@@ -79,6 +275,14 @@ class DatabaseTestCase(unittest.TestCase):
         self.assertEqual(results[1].last_name, 'Scott')
         self.assertEqual(results[1].height, 1.70)
 
+    def test_broadcast_query(self):
+        result = self.database.broadcast_query('SELECT 1')
+        self.assertEqual(result.successes, ['http://localhost:8123'])
+        self.assertEqual(len(result.errors), 0)
+        result = self.database.broadcast_query('SELECT nonexistent_function()', ensure=False)
+        self.assertEqual(result.successes, [])
+        self.assertEqual(list(result.errors), ['http://localhost:8123'])
+
     def test_models_naming(self):
         names = set(map(lambda x: x.name, self.database.select('SHOW TABLES FROM `test-db`')))
         self.assertSetEqual(names, {'person', 'custom_name'})
@@ -90,11 +294,153 @@ class DatabaseTestCase(unittest.TestCase):
         p = list(self.database.select("SELECT * from $table", Person))[0]
         self.assertEqual(p.first_name, s)
 
+    def test_paginate(self):
+        self.database.insert(self._sample_data())
+        page = self.database.paginate(Person, 'first_name, last_name', 2, 30)
+        self.assertEqual((page.number, page.pages_total, page.number_of_objects), (2, 4, 100))
+        self.assertEqual(len(page.objects), 30)
+        last_page = self.database.paginate(Person, 'first_name, last_name', -1, 30)
+        self.assertEqual(last_page.number, 4)
+        self.assertEqual(len(last_page.objects), 10)
+        with self.assertRaises(ValueError):
+            self.database.paginate(Person, 'first_name', 0)
+
+    def test_seek_pages(self):
+        self.database.insert(self._sample_data())
+        pages = list(self.database.seek_pages(Person, 30))
+        self.assertEqual([len(objects) for objects in pages], [30, 30, 30, 10])
+        offset_page = self.database.paginate(Person, 'first_name, last_name, birthday', 2, 30)
+        self.assertEqual(
+            [(p.first_name, p.last_name) for p in pages[1]],
+            [(p.first_name, p.last_name) for p in offset_page.objects],
+        )
+        objects = self.database.seek_page(Person, pages[0][-1], 10, "first_name > 'B'")
+        self.assertTrue(all(p.first_name > 'B' for p in objects))
+
+    def test_seek_pages__duplicates(self):
+        # Every row twice, and a key shared by more rows than fit on a page
+        self.database.insert(self._sample_data())
+        self.database.insert(self._sample_data())
+        same_key = [Person(first_name='Same', last_name='Key', birthday='2000-01-01', height=h)
+                    for h in (1.5, 1.6, 1.6, 1.7, 1.8)]
+        self.database.insert(same_key)
+        rows = [
+            (p.first_name, p.last_name, p.birthday, p.height)
+            for objects in self.database.seek_pages(Person, 3) for p in objects
+        ]
+        self.assertEqual(len(rows), 2 * len(data) + len(same_key))
+        self.assertEqual(rows, sorted(rows))
+        self.assertEqual(len([row for row in rows if row[0] == 'Same']), len(same_key))
+
+    def test_seek_pages__datetime_key(self):
+        start = datetime.datetime(2020, 1, 1, 12, 59, 59)
+        times = [start + datetime.timedelta(seconds=i // 3) for i in range(20)]
+        self.database.create_table(Event)
+        try:
+            self.database.insert(Event(day=t.date(), created=t, n=i) for i, t in enumerate(times))
+            for select_format in ('TabSeparatedWithNamesAndTypes', 'RowBinaryWithNamesAndTypes'):
+                self.database._select_format = select_format
+                # Times are compared as they were read, in the timezone of the server
+                events = list(self.database.select('SELECT * FROM $table ORDER BY created, day, n', Event))
+                rows = [
+                    (e.created, e.n)
+                    for objects in self.database.seek_pages(Event, 4) for e in objects
+                ]
+                self.assertEqual(rows, [(e.created, e.n) for e in events])
+                self.assertEqual([e.n for e in self.database.seek_page(Event, events[9], 3)], [10, 11, 12])
+        finally:
+            self.database.drop_table(Event)
+
+    def test_queryset(self):
+        self.database.insert(self._sample_data())
+        people = Person.objects(self.database).filter(first_name='Whitney')
+        self.assertEqual(people.count(), 2)
+        results = list(people.only('last_name', 'height').order_by('last_name'))
+        self.assertEqual([p.last_name for p in results], ['Durham', 'Scott'])
+        self.assertEqual(results[0].first_name, '')
+        tallest = list(Person.objects(self.database).order_by('-height')[:3])
+        self.assertEqual(len(tallest), 3)
+        self.assertEqual(Person.objects(self.database).filter(birthday__lt='1970-03-01').count(), 0)
+
+    def test_aggregate(self):
+        self.database.insert(self._sample_data())
+        result = self.database.aggregate(Person, sum=['height'], uniq=['first_name'])
+        self.assertEqual(list(result), ['count', 'sum_height', 'uniq_first_name'])
+        self.assertEqual(result['count'], [100])
+        result = Person.objects(self.database).filter(first_name__in=['Courtney', 'Whitney']).aggregate(
+            ['first_name'], avg=['height'],
+        )
+        self.assertEqual(result['first_name'], ['Courtney', 'Whitney'])
+        self.assertEqual(result['count'], [2, 2])
+        self.assertAlmostEqual(result['avg_height'][1], 1.71, places=5)
+        empty = self.database.aggregate(Person, ['first_name'], conditions="height > 3")
+        self.assertEqual(empty, OrderedDict([('first_name', []), ('count', [])]))
+        with self.assertRaises(ValueError):
+            self.database.aggregate(Person, sample=0.1)
+
     def _sample_data(self):
         for entry in data:
             yield Person(**entry)
 
 
+class SlowHost(ThreadingMixIn, HTTPServer):
+    '''
+    A fake host which answers SELECT queries after a delay and other queries
+    (CREATE DATABASE, KILL QUERY...) at once, recording the KILL queries.
+    '''
+    daemon_threads = True
+
+    def __init__(self, delay):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), SlowHostHandler)
+        self.delay = delay
+        self.kills = []
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
+
+
+class SlowHostHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        query = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode('utf-8')
+        if query.startswith('SELECT'):
+            time.sleep(self.server.delay)
+        elif query.startswith('KILL'):
+            self.server.kills.append(query)
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'0\n')
+
+    def log_message(self, *args):
+        pass
+
+
+class AggregateSQLTestCase(unittest.TestCase):
+
+    def test_sql(self):
+        self.assertEqual(
+            Database._aggregate_sql(
+                Visit, ['site'], ['duration'], ['duration'], ['user_id'], 'duration > 0', None,
+            ),
+            'SELECT site, count() AS count, sum(duration) AS sum_duration, avg(duration) AS avg_duration, '
+            'uniq(user_id) AS uniq_user_id FROM $table WHERE duration > 0 GROUP BY site ORDER BY site',
+        )
+        self.assertEqual(
+            Database._aggregate_sql(Visit, [], ['duration'], [], [], None, 0.1),
+            'SELECT sum(_sample_factor) AS count, sum(duration * _sample_factor) AS sum_duration '
+            'FROM $table SAMPLE 0.1',
+        )
+        with self.assertRaises(AttributeError):
+            Database._aggregate_sql(Visit, [], ['site_id'], [], [], None, None)
+
+
 class Person(Model):
 
     first_name = StringField()
@@ -114,6 +460,25 @@ class NamedModel(Model):
     engine = MergeTree('date_column', ('field',))
 
 
+class Event(Model):
+
+    day = DateField()
+    created = DateTimeField()
+    n = UInt64Field()
+
+    engine = MergeTree('day', ('created',))
+
+
+class Visit(Model):
+
+    date = DateField()
+    site = StringField()
+    user_id = UInt64Field()
+    duration = Float32Field()
+
+    engine = MergeTree('date', ('site', 'date', 'intHash32(user_id)'), sampling_expr='intHash32(user_id)')
+
+
 data = [
     {"first_name": "Abdul", "last_name": "Hester", "birthday": "1970-12-02", "height": "1.63"},
     {"first_name": "Adam", "last_name": "Goodman", "birthday": "1986-01-07", "height": "1.74"},
@@ -56,6 +56,71 @@ class ModelTestCase(unittest.TestCase):
         instance.int_field = '99'
         self.assertEqual(instance.int_field, 99)
 
+    def test_row_codecs(self):
+        # Check the generated encoders and decoders, including partial field orderings
+        instance = SimpleModel(date_field='1973-12-06', str_field='a\tb', float_field=0.5)
+        line = instance.to_tsv()
+        self.assertEqual(line, '\t'.join(
+            field.to_db_string(getattr(instance, name), quote=False) for name, field in SimpleModel._fields
+        ))
+        self.assertEqual(line.split('\t')[2], 'a\\tb')
+        copy = SimpleModel.from_tsv('1973-12-06\t1970-01-01 00:00:00\ta\\tb\t17\t0.5\n')
+        for name in ('date_field', 'str_field', 'int_field', 'float_field'):
+            self.assertEqual(getattr(copy, name), getattr(instance, name))
+        partial = SimpleModel.from_values(['7', 'x'], ['int_field', 'str_field'])
+        self.assertEqual((partial.int_field, partial.str_field), (7, 'x'))
+        self.assertEqual(partial.date_field, datetime.date(1970, 1, 1))
+        self.assertIs(
+            SimpleModel.row_decoder(['int_field', 'str_field']),
+            SimpleModel.row_decoder(('int_field', 'str_field')),
+        )
+        with self.assertRaises(ValueError):
+            SimpleModel.from_values(['nope'], ['int_field'])
+        with self.assertRaises(AttributeError):
+            SimpleModel.row_decoder(['pineapple'])
+
+    def test_row_decoder_without_validation(self):
+        # Values are still converted, but out of range values are accepted
+        decode = SimpleModel.row_decoder(['int_field', 'date_field'], validate=False)
+        instance = decode(['9999999999', '1973-12-06'])
+        self.assertEqual(instance.int_field, 9999999999)
+        self.assertEqual(instance.date_field, datetime.date(1973, 12, 6))
+        self.assertIsNot(decode, SimpleModel.row_decoder(['int_field', 'date_field']))
+        with self.assertRaises(ValueError):
+            SimpleModel.row_decoder(['int_field', 'date_field'])(['9999999999', '1973-12-06'])
+        with self.assertRaises(ValueError):
+            decode(['nope', '1973-12-06'])
+
+    def test_row_decoder_custom_init(self):
+        # Models with their own constructor are still created through it
+        class CountingModel(SimpleModel):
+            created = 0
+
+            def __init__(self, **kwargs):
+                super(CountingModel, self).__init__(**kwargs)
+                CountingModel.created += 1
+
+        instance = CountingModel.from_values(['5'], ['int_field'])
+        self.assertEqual((instance.int_field, CountingModel.created), (5, 1))
+
+    def test_lightweight_rows(self):
+        # Rows are converted but not validated, and have no __dict__
+        decode = SimpleModel.row_decoder(['int_field', 'str_field'], lightweight=True)
+        row = decode(['7', 'x'])
+        self.assertIsInstance(row, SimpleModel.row_class())
+        self.assertEqual((row.int_field, row.str_field), (7, 'x'))
+        self.assertEqual(row.date_field, datetime.date(1970, 1, 1))
+        self.assertEqual(row._asdict()['float_field'], 0)
+        self.assertFalse(hasattr(row, '__dict__'))
+        with self.assertRaises(AttributeError):
+            row.int_field = 8
+        self.assertEqual(decode(['9999999999', 'x']).int_field, 9999999999)
+        instance = row.to_model()
+        self.assertIsInstance(instance, SimpleModel)
+        self.assertEqual(instance.int_field, 7)
+        with self.assertRaises(ValueError):
+            decode(['9999999999', 'x']).to_model()
+
 
 class SimpleModel(Model):
 
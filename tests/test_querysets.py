@@ -0,0 +1,74 @@
+import unittest
+
+from clickhouse.engines import MergeTree
+from clickhouse.fields import DateField, Float32Field, StringField
+from clickhouse.models import Model
+
+
+class QuerySetTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.queryset = Person.objects(None)
+
+    def test_all(self):
+        self.assertEqual(self.queryset.as_sql(), 'SELECT * FROM $table')
+
+    def test_filter(self):
+        queryset = self.queryset.filter(first_name='Ann', birthday__gte='2000-01-01')
+        self.assertEqual(
+            queryset.as_sql(),
+            "SELECT * FROM $table WHERE birthday >= '2000-01-01' AND first_name = 'Ann'",
+        )
+        queryset = self.queryset.filter('height > 1.7', last_name__in=['Cole', "O'Hara"])
+        self.assertEqual(
+            queryset.conditions_as_sql(),
+            "(height > 1.7) AND last_name IN ('Cole', 'O\\'Hara')",
+        )
+        self.assertEqual(
+            self.queryset.exclude(first_name__startswith='A', height__lt=1.6).conditions_as_sql(),
+            "NOT (startsWith(first_name, 'A') AND height < 1.6)",
+        )
+        with self.assertRaises(AttributeError):
+            self.queryset.filter(age=30)
+        with self.assertRaises(ValueError):
+            self.queryset.filter(first_name__like='A%')
+        with self.assertRaises(ValueError):
+            self.queryset.filter(birthday='yesterday')
+        with self.assertRaises(ValueError):
+            self.queryset.filter(first_name__in=[])
+        with self.assertRaises(ValueError):
+            self.queryset.exclude()
+
+    def test_chaining(self):
+        queryset = self.queryset.filter(first_name='Ann')
+        ordered = queryset.only('first_name', 'height').order_by('-height', 'last_name')
+        # Querysets are not changed by refining them
+        self.assertEqual(queryset.as_sql(), "SELECT * FROM $table WHERE first_name = 'Ann'")
+        self.assertEqual(
+            ordered[20:30].as_sql(),
+            "SELECT first_name, height FROM $table WHERE first_name = 'Ann' "
+            "ORDER BY height DESC, last_name LIMIT 20, 10",
+        )
+        self.assertEqual(ordered.limit(5).as_sql(), ordered[:5].as_sql())
+        with self.assertRaises(AttributeError):
+            self.queryset.only('age')
+        with self.assertRaises(ValueError):
+            self.queryset[10:]
+        with self.assertRaises(TypeError):
+            self.queryset[0]
+
+    def test_slicing_limited(self):
+        queryset = self.queryset.limit(10, 20)
+        self.assertEqual(queryset[5:100].as_sql(), 'SELECT * FROM $table LIMIT 25, 5')
+        self.assertEqual(queryset[2:4].as_sql(), 'SELECT * FROM $table LIMIT 22, 2')
+        self.assertEqual(queryset[15:20].as_sql(), 'SELECT * FROM $table LIMIT 30, 0')
+
+
+class Person(Model):
+
+    first_name = StringField()
+    last_name = StringField()
+    birthday = DateField()
+    height = Float32Field()
+
+    engine = MergeTree('birthday', ('first_name', 'last_name', 'birthday'))
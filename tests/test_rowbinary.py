@@ -0,0 +1,196 @@
+import datetime
+import decimal
+import unittest
+
+import pytz
+
+from clickhouse.database import Database
+from clickhouse.engines import MergeTree
+from clickhouse.fields import (ArrayField, DateField, DateTimeField, DecimalField, Enum8Field,
+                               FixedStringField, Float64Field, Int8Field, Int32Field,
+                               NullableField, StringField, UInt16Field)
+from clickhouse.models import Model, ModelBase
+from clickhouse.utils import BinaryFeedReader, BinaryReader, write_string, write_varint
+
+try:
+    Enum  # exists in Python 3.4+
+except NameError:
+    from enum import Enum  # use the enum34 library instead
+
+
+class RowBinaryTestCase(unittest.TestCase):
+
+    def test_varint(self):
+        self.assertEqual(write_varint(0), b'\x00')
+        self.assertEqual(write_varint(127), b'\x7f')
+        self.assertEqual(write_varint(128), b'\x80\x01')
+        self.assertEqual(write_varint(300), b'\xac\x02')
+
+    def test_fixed_width_fields(self):
+        self.assertEqual(UInt16Field().to_binary(258), b'\x02\x01')
+        self.assertEqual(Int8Field().to_binary(-1), b'\xff')
+        self.assertEqual(Float64Field().to_binary(1.0), b'\x00\x00\x00\x00\x00\x00\xf0?')
+        self.assertEqual(DateField().to_binary(datetime.date(1970, 1, 3)), b'\x02\x00')
+        self.assertEqual(Enum8Field(Color).to_binary(Color.green), b'\x02')
+
+    def test_datetime_field(self):
+        field = DateTimeField()
+        # Aware values are converted from their timezone whatever the local one is
+        self.assertEqual(field.to_binary(field.class_default), b'\x00\x00\x00\x00')
+        self.assertEqual(field.to_binary(datetime.datetime(1970, 1, 1, 0, 1, tzinfo=pytz.utc)), b'<\x00\x00\x00')
+        with self.assertRaises(ValueError):
+            field.to_binary(datetime.datetime(1960, 1, 1, tzinfo=pytz.utc))
+
+    def test_string_fields(self):
+        self.assertEqual(StringField().to_binary(u'été'), b'\x05\xc3\xa9t\xc3\xa9')
+        self.assertEqual(FixedStringField(4).to_binary(u'ab'), b'ab\x00\x00')
+        with self.assertRaises(ValueError):
+            FixedStringField(1).to_binary(u'ab')
+
+    def test_array_field(self):
+        field = ArrayField(StringField())
+        self.assertEqual(field.to_binary([u'a', u'bc']), b'\x02\x01a\x02bc')
+        self.assertEqual(field.to_binary([]), b'\x00')
+
+    def test_model(self):
+        instance = BinaryModel(date_field='1970-01-02', str_field='x', arr_field=[1, 2])
+        self.assertEqual(instance.to_rowbinary(), b'\x01\x00' + b'\x01x' + b'\x02\x01\x00\x02\x00')
+
+    def test_reader_across_chunks(self):
+        data = write_varint(300) + b'abc' + b'\x02\x01'
+        reader = BinaryReader(data[i:i + 1] for i in range(len(data)))
+        self.assertEqual(reader.read_varint(), 300)
+        self.assertEqual(reader.read(3), b'abc')
+        self.assertEqual(reader.unpack(UInt16Field.binary_format), 258)
+        self.assertTrue(reader.at_eof())
+        with self.assertRaises(EOFError):
+            reader.read(1)
+
+    def test_feed_reader(self):
+        instance = BinaryModel(date_field='2016-08-30', str_field=u'\t\u05d0', arr_field=[7, 8])
+        data = instance.to_rowbinary() * 3
+        reader = BinaryFeedReader()
+        decoded = []
+        for i in range(len(data)):
+            reader.feed(data[i:i + 1])
+            try:
+                while not reader.at_eof():
+                    values = [field.read_binary(reader) for name, field in BinaryModel._fields]
+                    reader.commit()
+                    decoded.append(BinaryModel(**dict(zip([name for name, field in BinaryModel._fields], values))))
+            except EOFError:
+                reader.rollback()
+        self.assertEqual([row.to_rowbinary() for row in decoded], [instance.to_rowbinary()] * 3)
+        self.assertEqual(reader.tell(), len(data))
+
+    def test_decode(self):
+        instance = BinaryModel(date_field='2016-08-30', str_field=u'\t\u05d0', arr_field=[7, 8])
+        reader = BinaryReader([instance.to_rowbinary()])
+        kwargs = {}
+        for name, field in BinaryModel._fields:
+            kwargs[name] = field.read_binary(reader)
+        decoded = BinaryModel(**kwargs)
+        for name, field in BinaryModel._fields:
+            self.assertEqual(getattr(decoded, name), getattr(instance, name))
+
+    def test_decode_ad_hoc_fields(self):
+        for db_type, value in (('Float32', 1.72), ('FixedString(3)', u'ab\0'), ('Enum8(\'red\' = 1)', 1)):
+            field = ModelBase.create_ad_hoc_field(db_type)
+            reader = BinaryReader([field.to_binary(field.to_python(value))])
+            self.assertEqual(field.read_binary(reader), value)
+
+    def test_decode_datetime(self):
+        field = DateTimeField()
+        value = datetime.datetime(2020, 1, 1, 12)
+        decoded = field.read_binary(BinaryReader([field.to_binary(value)]))
+        # Naive, like the values parsed from TabSeparated
+        self.assertEqual(decoded, value)
+        self.assertEqual(decoded, field.to_python('2020-01-01 12:00:00'))
+
+    def test_decode_datetime__timezone(self):
+        field = DateTimeField(timezone='Asia/Tokyo')
+        self.assertEqual(field.read_binary(BinaryReader([b'\x00\x00\x00\x00'])), datetime.datetime(1970, 1, 1, 9))
+        self.assertEqual(field.to_binary(datetime.datetime(1970, 1, 1, 9)), b'\x00\x00\x00\x00')
+        # DateTime values are the server's wall-clock time, as in TabSeparated,
+        # DateTime('tz') values the wall-clock time of the column's timezone
+        body = self._rowbinary_response(
+            ['date_field', 'created', 'updated'], ['Date', 'DateTime', "DateTime('UTC')"],
+            [[datetime.date(1970, 1, 1), datetime.datetime(1970, 1, 1, 9), datetime.datetime(1970, 1, 1, 0, 1)]],
+        )
+        # The body was encoded in local time, decode it with a timezone one hour off
+        offset = datetime.datetime.fromtimestamp(0) - datetime.datetime.utcfromtimestamp(0)
+        timezone = pytz.FixedOffset(int(offset.total_seconds()) // 60 + 60)
+        result = list(Database._iter_rowbinary(FakeResponse(body), DateTimeModel, False, True, timezone))[0]
+        self.assertEqual(result.created, datetime.datetime(1970, 1, 1, 10))
+        self.assertEqual(result.updated, datetime.datetime(1970, 1, 1, 0, 1))
+
+    def test_decode_wrapped_types(self):
+        types = ['LowCardinality(String)', 'Nullable(Int32)', 'Decimal(9, 2)', 'Decimal128(3)']
+        rows = [
+            [u'a', None, decimal.Decimal('1.25'), decimal.Decimal('-2.5')],
+            [u'b', 7, decimal.Decimal('-3.50'), decimal.Decimal(2**70)],
+        ]
+        body = self._rowbinary_response(['name', 'count', 'price', 'big'], types, rows)
+        # Columns the model declares with the same type are decoded by its fields,
+        # the others (and all of them without a model) by ad hoc fields
+        for model_class in (TypedModel, None):
+            results = list(Database._iter_rowbinary(FakeResponse(body), model_class, False, True))
+            self.assertEqual([[getattr(r, name) for name in ('name', 'count', 'price', 'big')]
+                              for r in results], rows)
+        price_field = dict(TypedModel._fields)['price']
+        self.assertIs(Database._decoding_field(price_field, 'Decimal(9, 2)'), price_field)
+        self.assertIsNone(ModelBase.create_ad_hoc_field('Nullable(Int32)').to_python('\\N'))
+        with self.assertRaises(NotImplementedError):
+            ModelBase.create_ad_hoc_field('Decimal256(2)')
+
+    @staticmethod
+    def _rowbinary_response(names, types, rows):
+        fields = [ModelBase.create_ad_hoc_field(db_type) for db_type in types]
+        parts = [write_varint(len(names))]
+        parts.extend(write_string(name) for name in names)
+        parts.extend(write_string(db_type) for db_type in types)
+        for row in rows:
+            parts.extend(field.to_binary(value) for field, value in zip(fields, row))
+        return b''.join(parts)
+
+
+class FakeResponse(object):
+
+    def __init__(self, body):
+        self.body = body
+
+    def iter_content(self, chunk_size):
+        # One byte at a time, so that values straddle chunks
+        return (self.body[i:i + 1] for i in range(len(self.body)))
+
+
+Color = Enum('Color', u'red green blue')
+
+
+class BinaryModel(Model):
+
+    date_field = DateField()
+    str_field = StringField()
+    arr_field = ArrayField(UInt16Field())
+
+    engine = MergeTree('date_field', ('date_field',))
+
+
+class DateTimeModel(Model):
+
+    date_field = DateField()
+    created = DateTimeField()
+    updated = DateTimeField()
+
+    engine = MergeTree('date_field', ('date_field',))
+
+
+class TypedModel(Model):
+
+    date_field = DateField()
+    name = StringField()
+    count = NullableField(Int32Field())
+    price = DecimalField(9, 2)
+    big = DecimalField(38, 3)
+
+    engine = MergeTree('date_field', ('date_field',))
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import io
+import unittest
+
+from clickhouse.utils import iter_tsv_rows, parse_tsv, parse_tsv_rows, read_tsv_rows
+
+
+class TSVParsingTestCase(unittest.TestCase):
+
+    def test_parse_tsv(self):
+        self.assertEqual(parse_tsv(b'1\tabc\t\n'), [u'1', u'abc', u''])
+        self.assertEqual(parse_tsv(u'1\tabc'), [u'1', u'abc'])
+        self.assertEqual(parse_tsv(b''), [u''])
+
+    def test_parse_tsv_escapes(self):
+        line = u'a\\tb\t\\\\\tплохо\\n\t\\\'x\\\'\n'.encode('utf-8')
+        self.assertEqual(parse_tsv(line), [u'a\tb', u'\\', u'плохо\n', u"'x'"])
+
+    def test_parse_tsv_rows(self):
+        data = u'1\tабв\n2\tx\\ty\n3\t\n'.encode('utf-8')
+        rows = [[u'1', u'абв'], [u'2', u'x\ty'], [u'3', u'']]
+        self.assertEqual(parse_tsv_rows(data), rows)
+        self.assertEqual(parse_tsv_rows(data.replace(b'\\t', b'-')), [rows[0], [u'2', u'x-y'], rows[2]])
+        self.assertEqual(parse_tsv_rows(b''), [])
+
+    def test_iter_tsv_rows(self):
+        data = u'1\tабв\n2\tx\\ty\n3\tlast'.encode('utf-8')
+        expected = [[u'1', u'абв'], [u'2', u'x\ty'], [u'3', u'last']]
+        # Every split point, including ones inside multi-byte characters and escapes
+        for size in range(1, len(data) + 1):
+            chunks = [data[i:i + size] for i in range(0, len(data), size)]
+            self.assertEqual(list(iter_tsv_rows(chunks)), expected)
+
+    def test_read_tsv_rows(self):
+        data = u'1\tабв\n2\tx\\ty\n3\t%s\n4\tlast' % (u'long' * 10)
+        expected = [[u'1', u'абв'], [u'2', u'x\ty'], [u'3', u'long' * 10], [u'4', u'last']]
+        # Reads of every size, with a buffer smaller than the long line
+        for size in range(1, 12):
+            stream = SlowStream(data.encode('utf-8'), size)
+            self.assertEqual(list(read_tsv_rows(stream, buffer_size=8)), expected)
+        self.assertEqual(list(read_tsv_rows(io.BytesIO(b''))), [])
+
+
+class SlowStream(io.BytesIO):
+    '''
+    Returns at most size bytes from every readinto call.
+    '''
+
+    def __init__(self, data, size):
+        super(SlowStream, self).__init__(data)
+        self.size = size
+
+    def readinto(self, b):
+        return super(SlowStream, self).readinto(memoryview(b)[:self.size])